@@ -1,6 +1,7 @@
-from flask import Flask, request, render_template_string, jsonify
+from flask import Flask, request, render_template_string, jsonify, abort, Response, stream_with_context
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, SoupStrainer
 import time
 import hmac
 import hashlib
@@ -8,11 +9,30 @@ import base64
 import urllib.parse
 import os
 import re
+import queue
+import threading
+import atexit
+import uuid
+import io
+import csv
+import zipfile
+from xml.sax.saxutils import escape as xml_escape
+from datetime import datetime, timedelta
+import random
+import bisect
+import unicodedata
+import json
+import sqlite3
+from collections import OrderedDict, Counter, deque
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
+from contextlib import contextmanager
 
 # 셀레니움 관련 라이브러리 추가
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException, WebDriverException
 
 app = Flask(__name__)
 
@@ -22,6 +42,11 @@ AD_CUSTOMER_ID = os.environ.get("CUSTOMER_ID", "")
 NAVER_CLIENT_ID = os.environ.get("NAVER_CLIENT_ID", "")
 NAVER_CLIENT_SECRET = os.environ.get("NAVER_CLIENT_SECRET", "")
 
+# 업스트림 주소 (벤치마크용 목 서버로 바꿔 끼울 때만 지정)
+NAVER_AD_API_BASE = os.environ.get("NAVER_AD_API_BASE", "https://api.naver.com")
+NAVER_OPENAPI_BASE = os.environ.get("NAVER_OPENAPI_BASE", "https://openapi.naver.com")
+NAVER_SEARCH_BASE = os.environ.get("NAVER_SEARCH_BASE", "https://search.naver.com")
+
 def get_ad_header(method, uri):
     timestamp = str(int(time.time() * 1000))
     message = f"{timestamp}.{method}.{uri}"
@@ -35,162 +60,1384 @@ def get_ad_header(method, uri):
         "X-Signature": signature
     }
 
-def get_html_with_selenium(url):
-    """셀레니움을 이용해 실제 브라우저처럼 HTML을 가져오는 함수"""
+# --- 업스트림 호스트별 HTTP 세션 (keep-alive 커넥션 풀 + 재시도) ---
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 16))
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", 3))
+HTTP_BACKOFF_BASE = float(os.environ.get("HTTP_BACKOFF_BASE", 0.3))
+HTTP_BACKOFF_MAX = float(os.environ.get("HTTP_BACKOFF_MAX", 5))
+KEYWORD_DEADLINE = float(os.environ.get("KEYWORD_DEADLINE", 45)) # 키워드 하나에 쓸 수 있는 최대 시간(초)
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+class DeadlineExceeded(Exception):
+    pass
+
+class RequestCancelled(Exception):
+    pass
+
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+def get_session(url):
+    host = urllib.parse.urlsplit(url).netloc
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _SESSIONS[host] = session
+    return session
+
+def new_deadline():
+    return time.monotonic() + KEYWORD_DEADLINE
+
+def backoff_delay(attempt, res=None):
+    if res is not None and res.status_code == 429:
+        retry_after = res.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(float(retry_after), HTTP_BACKOFF_MAX)
+    # full jitter 지수 백오프
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+def http_request(method, url, deadline=None, timeout=5, limiter=None, stop=None, **kwargs):
+    """풀링된 세션으로 요청하고 429/5xx/연결 오류는 deadline 안에서 재시도
+
+    limiter 를 주면 재시도를 포함한 매 시도마다 토큰을 받음 (재시도도 초당 요청 수와 쿼터에 들어감)
+    stop 이벤트가 켜지면 토큰을 기다리던 중이라도 요청하지 않고 RequestCancelled
+    """
+    session = get_session(url)
+    host = urllib.parse.urlsplit(url).netloc
+    attempt = 0
+    while True:
+        if limiter is not None:
+            limiter.acquire(deadline, stop=stop)
+        if stop is not None and stop.is_set():
+            raise RequestCancelled(url)
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(url)
+        res = None
+        try:
+            res = session.request(method, url, timeout=timeout if remaining is None else min(timeout, remaining), **kwargs)
+            METRICS.inc("bookall_upstream_requests_total", host=host, status=str(res.status_code))
+            if res.status_code not in RETRY_STATUS or attempt >= HTTP_MAX_RETRIES:
+                return res
+        except (requests.ConnectionError, requests.Timeout):
+            METRICS.inc("bookall_upstream_requests_total", host=host, status="error")
+            if attempt >= HTTP_MAX_RETRIES:
+                raise
+
+        delay = backoff_delay(attempt, res)
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            if res is not None:
+                return res
+            raise DeadlineExceeded(url)
+        time.sleep(delay)
+        attempt += 1
+
+# --- 단계별 소요 시간 / 결과 지표 (/metrics 에서 Prometheus 텍스트 형식으로 노출) ---
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def metric_labels(labels):
+    if not labels:
+        return ""
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}"
+
+class Metrics:
+    """프로세스 안에서 모으는 히스토그램과 카운터"""
+
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._histograms = {} # (이름, 라벨) -> [버킷별 개수..., +Inf 개수, 합계]
+        self._counters = Counter() # (이름, 라벨) -> 값
+
+    @staticmethod
+    def key(name, labels):
+        # 라벨 값은 문자열로 맞춰둬야 render 에서 정렬할 때 int/str 비교가 생기지 않음
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def observe(self, name, seconds, **labels):
+        key = self.key(name, labels)
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            histogram[index] += 1
+            histogram[-1] += seconds
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[self.key(name, labels)] += value
+
+    def render(self, gauges=()):
+        """gauges: (이름, [(라벨 dict, 값), ...]) 목록. 요청 시점에 계산한 현재값"""
+        with self._lock:
+            histograms = {key: list(value) for key, value in self._histograms.items()}
+            counters = dict(self._counters)
+        lines = []
+        seen = set()
+        for (name, labels), histogram in sorted(histograms.items()):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), histogram):
+                cumulative += count
+                lines.append(f"{name}_bucket{metric_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{metric_labels(labels)} {histogram[-1]:.6f}")
+            lines.append(f"{name}_count{metric_labels(labels)} {cumulative}")
+        for (name, labels), value in sorted(counters.items()):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{metric_labels(labels)} {value}")
+        for name, samples in gauges:
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{metric_labels(tuple(sorted(labels.items())))} {value}")
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics()
+
+@contextmanager
+def timed_stage(stage, timings=None):
+    """with 블록의 소요 시간을 bookall_stage_seconds 에 기록
+
+    블록 안에서 돌려받은 dict 의 outcome / cache 값을 바꾸면 그 라벨로 기록된다.
+    timings dict 를 넘기면 {단계: 밀리초} 도 같이 채운다.
+    """
+    labels = {"outcome": "ok", "cache": "miss"}
+    start = time.perf_counter()
+    try:
+        yield labels
+    except DeadlineExceeded:
+        labels["outcome"] = "timeout"
+        raise
+    except Exception:
+        labels["outcome"] = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        METRICS.observe("bookall_stage_seconds", elapsed, stage=stage, **labels)
+        if timings is not None:
+            timings[stage] = round(elapsed * 1000, 1)
+
+# --- SQLite 공통 연결 (스레드마다 하나씩) ---
+class SqliteDB:
+    """스레드마다 연결을 하나씩 열어 재사용 (WAL, autocommit)
+
+    테이블은 연결을 처음 열 때 만들기 때문에 import 만으로는 파일이 생기지 않는다.
+    columns 에는 나중에 추가된 열을 {테이블: [(열 이름, 정의)]} 로 주면 예전 파일에도 ALTER TABLE 로 붙여준다.
+    """
+
+    def __init__(self, path, schema=(), synchronous="FULL", columns=None):
+        self.path = path
+        self.schema = schema
+        self.synchronous = synchronous
+        self.columns = columns or {}
+        self._local = threading.local()
+
+    def conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            for statement in self.schema:
+                conn.execute(statement)
+            for table, added in self.columns.items():
+                existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+                for name, definition in added:
+                    if name not in existing:
+                        try:
+                            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+                        except sqlite3.OperationalError:
+                            pass # 다른 프로세스가 먼저 추가함
+            self._local.conn = conn
+        return conn
+
+# --- 업스트림별 속도 제한 + 일일 쿼터 (gunicorn 워커끼리 SQLite 파일로 상태 공유) ---
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "sqlite").lower() # sqlite / memory
+RATE_LIMIT_PATH = os.environ.get("RATE_LIMIT_PATH", "bookall_ratelimit.sqlite3")
+RATE_LIMIT_CONFIG = {
+    # 이름: (초당 요청 수, 순간 최대 허용량, 일일 쿼터 (0이면 무제한))
+    "ad": (float(os.environ.get("AD_API_RATE_PER_SEC", 5)), 5, int(os.environ.get("AD_API_DAILY_QUOTA", 0))),
+    "book": (float(os.environ.get("BOOK_RATE_PER_SEC", 10)), 10, int(os.environ.get("BOOK_DAILY_QUOTA", 25000))),
+    "shop": (float(os.environ.get("SHOP_RATE_PER_SEC", 10)), 10, int(os.environ.get("SHOP_DAILY_QUOTA", 25000))),
+    "search": (float(os.environ.get("SEARCH_RATE_PER_SEC", 2)), 4, 0),
+}
+
+class QuotaExceeded(DeadlineExceeded):
+    pass
+
+def seconds_until_tomorrow():
+    now = datetime.now()
+    return (datetime.combine(now.date() + timedelta(days=1), datetime.min.time()) - now).total_seconds()
+
+class RateLimiter:
+    """토큰 버킷: 초당 rate 개, 최대 burst 개까지 몰아서 허용 (프로세스 내부용)"""
+
+    def __init__(self, name, rate, burst=None, daily_quota=0):
+        self.name = name
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.daily_quota = daily_quota
+        self._tokens = float(self.burst)
+        self._updated = time.time()
+        self._day = ""
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def _take(self):
+        """토큰을 하나 가져가고 0을, 부족하면 기다릴 시간(초)을 돌려줌"""
+        with self._lock:
+            now = time.time()
+            today = datetime.now().strftime("%Y-%m-%d")
+            if today != self._day:
+                self._day, self._used = today, 0
+            if self.daily_quota and self._used >= self.daily_quota:
+                raise QuotaExceeded(f"{self.name} 일일 쿼터 {self.daily_quota}회 소진")
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self._used += 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, deadline=None, stop=None):
+        """토큰이 생길 때까지 대기 (실패시키지 않고 늦춤). deadline 을 넘길 것 같으면 DeadlineExceeded
+
+        stop 이벤트가 켜지면 토큰을 가져가지 않고 RequestCancelled
+        """
+        while True:
+            if stop is not None and stop.is_set():
+                raise RequestCancelled(f"{self.name} rate limit")
+            try:
+                wait = self._take()
+            except QuotaExceeded:
+                # 쿼터는 자정에 초기화되므로 그때까지 기다릴 수 있는 경우에만 대기
+                wait = seconds_until_tomorrow() + 1
+                if deadline is None or time.monotonic() + wait > deadline:
+                    raise
+            if not wait:
+                return
+            if deadline is not None and time.monotonic() + wait > deadline:
+                raise DeadlineExceeded(f"{self.name} rate limit")
+            if stop is not None:
+                stop.wait(wait)
+            else:
+                time.sleep(wait)
+
+    def stats(self):
+        with self._lock:
+            return {"rate": self.rate, "daily_quota": self.daily_quota, "used_today": self._used}
+
+class SharedRateLimiter(RateLimiter):
+    """같은 SQLite 파일을 보는 모든 프로세스가 하나의 버킷과 쿼터를 나눠 씀"""
+
+    def __init__(self, name, rate, burst=None, daily_quota=0, path=RATE_LIMIT_PATH):
+        super().__init__(name, rate, burst, daily_quota)
+        self.db = SqliteDB(path, schema=(
+            "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)",
+            "CREATE TABLE IF NOT EXISTS quota (name TEXT NOT NULL, day TEXT NOT NULL, used INTEGER NOT NULL, PRIMARY KEY (name, day))",
+        ))
+
+    def _take(self):
+        conn = self.db.conn()
+        now = time.time()
+        today = datetime.now().strftime("%Y-%m-%d")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT used FROM quota WHERE name = ? AND day = ?", (self.name, today)).fetchone()
+            used = row[0] if row else 0
+            if self.daily_quota and used >= self.daily_quota:
+                conn.execute("COMMIT")
+                raise QuotaExceeded(f"{self.name} 일일 쿼터 {self.daily_quota}회 소진")
+
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE name = ?", (self.name,)).fetchone()
+            tokens, updated_at = row if row else (float(self.burst), now)
+            tokens = min(self.burst, tokens + max(0, now - updated_at) * self.rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+                conn.execute("INSERT INTO quota (name, day, used) VALUES (?, ?, 1) "
+                             "ON CONFLICT (name, day) DO UPDATE SET used = used + 1", (self.name, today))
+            else:
+                wait = (1 - tokens) / self.rate
+            conn.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)", (self.name, tokens, now))
+            conn.execute("COMMIT")
+            return wait
+        except QuotaExceeded:
+            raise
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def stats(self):
+        today = datetime.now().strftime("%Y-%m-%d")
+        row = self.db.conn().execute("SELECT used FROM quota WHERE name = ? AND day = ?", (self.name, today)).fetchone()
+        return {"rate": self.rate, "daily_quota": self.daily_quota, "used_today": row[0] if row else 0}
+
+def create_rate_limiter(name):
+    rate, burst, daily_quota = RATE_LIMIT_CONFIG[name]
+    if RATE_LIMIT_BACKEND == "sqlite":
+        return SharedRateLimiter(name, rate, burst, daily_quota)
+    return RateLimiter(name, rate, burst, daily_quota)
+
+RATE_LIMITERS = {name: create_rate_limiter(name) for name in RATE_LIMIT_CONFIG}
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36"
+
+# 브라우저 풀 설정 (환경변수로 조절)
+BROWSER_POOL_SIZE = int(os.environ.get("BROWSER_POOL_SIZE", 2))
+BROWSER_MAX_PAGES = int(os.environ.get("BROWSER_MAX_PAGES", 200)) # 이 횟수만큼 쓰면 브라우저 재시작
+BROWSER_ACQUIRE_TIMEOUT = float(os.environ.get("BROWSER_ACQUIRE_TIMEOUT", 60))
+BROWSER_WARM = os.environ.get("BROWSER_WARM", "0") == "1" # 1 이면 서버 시작 때 브라우저를 풀 크기만큼 미리 띄움
+SERP_WAIT_TIMEOUT = float(os.environ.get("SERP_WAIT_TIMEOUT", 5))
+
+# #main_pack 이 생기거나 캡차/차단 문구가 보이면 렌더링 완료로 판단
+SERP_READY_SCRIPT = """
+if (document.getElementById('main_pack')) return true;
+var body = document.body ? document.body.innerText : '';
+return /captcha|비정상적인/i.test(body) || /captcha/i.test(document.title);
+"""
+
+def create_chrome_driver():
     chrome_options = Options()
     chrome_options.add_argument("--headless") # 화면 없이 백그라운드에서 실행
     chrome_options.add_argument("--no-sandbox")
     chrome_options.add_argument("--disable-dev-shm-usage")
     # 실제 사람인 것처럼 속이기 위한 User-Agent 설정
-    chrome_options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36")
-    
+    chrome_options.add_argument(f"user-agent={USER_AGENT}")
+    # DOMContentLoaded 시점에 get()이 반환되도록 (나머지는 명시적 대기로 처리)
+    chrome_options.page_load_strategy = "eager"
+
     # Dockerfile에 설정된 환경변수를 활용하여 크롬 경로 지정
     binary_location = os.environ.get("CHROME_BIN", "/usr/bin/chromium")
     driver_path = os.environ.get("CHROMEDRIVER_PATH", "/usr/bin/chromedriver")
-    
+
     chrome_options.binary_location = binary_location
     service = Service(executable_path=driver_path)
-    
-    driver = webdriver.Chrome(service=service, options=chrome_options)
-    try:
+
+    with timed_stage("browser_launch"):
+        driver = webdriver.Chrome(service=service, options=chrome_options)
+    driver.set_page_load_timeout(max(SERP_WAIT_TIMEOUT * 3, 15))
+    return driver
+
+class PooledDriver:
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+
+    def is_alive(self):
+        try:
+            return self.driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except Exception:
+            pass
+
+class BrowserPool:
+    """크롬 드라이버를 키워드마다 재사용하는 풀
+
+    드라이버는 처음 필요할 때 띄운다. warm() 을 부르면 size 개까지 미리 띄워 둔다.
+    """
+
+    def __init__(self, size, max_pages):
+        self.size = max(1, size)
+        self.max_pages = max(1, max_pages)
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.waiting = 0
+        self.created = 0
+        self.recycled = 0
+
+    def acquire(self, timeout=None):
+        with self._lock:
+            self.waiting += 1
+        try:
+            with timed_stage("browser_wait") as stage:
+                if not self._slots.acquire(timeout=timeout):
+                    stage["outcome"] = "timeout"
+                    raise TimeoutError("브라우저 풀 대기 시간 초과")
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        try:
+            entry = None
+            while entry is None:
+                try:
+                    entry = self._idle.get_nowait()
+                except queue.Empty:
+                    entry = PooledDriver(create_chrome_driver())
+                    with self._lock:
+                        self.created += 1
+                    break
+                # 죽은 브라우저는 버리고 새로 띄움
+                if not entry.is_alive():
+                    entry.quit()
+                    with self._lock:
+                        self.recycled += 1
+                    entry = None
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.in_use += 1
+        return entry
+
+    def release(self, entry, broken=False):
+        entry.pages += 1
+        if broken or entry.pages >= self.max_pages:
+            entry.quit()
+            with self._lock:
+                self.recycled += 1
+        else:
+            self._idle.put(entry)
+        with self._lock:
+            self.in_use -= 1
+        self._slots.release()
+
+    @contextmanager
+    def driver(self, timeout=None):
+        entry = self.acquire(timeout=timeout)
+        broken = False
+        try:
+            yield entry.driver
+        except WebDriverException:
+            broken = True
+            raise
+        finally:
+            self.release(entry, broken=broken)
+
+    def warm(self):
+        """빈 슬롯만큼 드라이버를 띄워서 놀고 있는 목록에 넣어 둠 (첫 키워드가 브라우저 기동을 기다리지 않게)"""
+        while self._idle.qsize() + self.in_use < self.size and self._slots.acquire(blocking=False):
+            try:
+                entry = PooledDriver(create_chrome_driver())
+                with self._lock:
+                    self.created += 1
+                self._idle.put(entry)
+            except Exception:
+                break
+            finally:
+                self._slots.release()
+
+    def shutdown(self):
+        while True:
+            try:
+                self._idle.get_nowait().quit()
+            except queue.Empty:
+                break
+
+BROWSER_POOL = BrowserPool(BROWSER_POOL_SIZE, BROWSER_MAX_PAGES)
+atexit.register(BROWSER_POOL.shutdown)
+
+def get_html_with_selenium(url, timeout=BROWSER_ACQUIRE_TIMEOUT):
+    """셀레니움을 이용해 실제 브라우저처럼 HTML을 가져오는 함수"""
+    with BROWSER_POOL.driver(timeout=timeout) as driver, timed_stage("browser_render") as stage:
         driver.get(url)
-        time.sleep(1.5) # 페이지가 렌더링될 때까지 잠깐 기다림
+        try:
+            # 고정 sleep 대신 검색결과 영역이나 캡차가 나타날 때까지만 대기
+            WebDriverWait(driver, SERP_WAIT_TIMEOUT, poll_frequency=0.1).until(
+                lambda d: d.execute_script(SERP_READY_SCRIPT)
+            )
+        except TimeoutException:
+            stage["outcome"] = "wait_timeout" # 시간 초과 시 현재 페이지 그대로 판정
         html_text = driver.page_source
-    finally:
-        driver.quit() # 메모리 낭비를 막기 위해 브라우저 닫기
-        
+
     return html_text
 
-def analyze_book(keyword, fetch_isbn=False, min_search_volume=0):
-    search_volume = 0
+# --- 업스트림 응답 캐시 (데이터 종류별 TTL) ---
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "memory").lower() # memory / sqlite / none
+CACHE_PATH = os.environ.get("CACHE_PATH", "bookall_cache.sqlite3")
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", 64 * 1024 * 1024))
+CACHE_TTLS = {
+    "volume": int(os.environ.get("CACHE_TTL_VOLUME", 30 * 24 * 3600)), # 검색량은 월 단위로 갱신
+    "serp": int(os.environ.get("CACHE_TTL_SERP", 24 * 3600)),          # 검색결과 등급은 하루
+    "isbn": int(os.environ.get("CACHE_TTL_ISBN", 7 * 24 * 3600)),
+    "rank": int(os.environ.get("CACHE_TTL_RANK", 3600)),               # 스토어 순위는 한 시간
+}
+
+class MemoryCacheBackend:
+    """프로세스 내부 LRU (직렬화 크기 합계가 max_bytes 를 넘으면 오래된 것부터 제거)"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at, nbytes = entry
+            if expires_at < time.time():
+                del self._data[key]
+                self.size -= nbytes
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        nbytes = len(key) + len(json.dumps(value, ensure_ascii=False))
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= old[2]
+            self._data[key] = (value, expires_at, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes and self._data:
+                _, (_, _, evicted) = self._data.popitem(last=False)
+                self.size -= evicted
+
+class SqliteCacheBackend:
+    """gunicorn 워커들이 같이 쓰는 디스크 캐시"""
+
+    def __init__(self, path):
+        self.db = SqliteDB(path, schema=(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)",
+        ), synchronous="NORMAL")
+        self._writes = 0
+
+    def get(self, key):
+        row = self.db.conn().execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, key, value, expires_at):
+        with self.db.conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                         (key, json.dumps(value, ensure_ascii=False), expires_at))
+            self._writes += 1
+            if self._writes % 1000 == 0: # 가끔씩 만료된 항목 정리
+                conn.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+
+class TTLCache:
+    def __init__(self, backend, ttls):
+        self.backend = backend
+        self.ttls = ttls
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def get(self, kind, key):
+        value = None
+        if self.backend is not None:
+            try:
+                value = self.backend.get(f"{kind}:{key}")
+            except Exception:
+                value = None
+        if value is None:
+            self.misses[kind] += 1
+        else:
+            self.hits[kind] += 1
+        return value
+
+    def set(self, kind, key, value):
+        if self.backend is None or value is None:
+            return
+        try:
+            self.backend.set(f"{kind}:{key}", value, time.time() + self.ttls[kind])
+        except Exception:
+            pass # 캐시 저장 실패는 분석 결과에 영향 주지 않음
+
+    def stats(self):
+        kinds = sorted(set(self.hits) | set(self.misses))
+        return {
+            "backend": CACHE_BACKEND,
+            "hits": dict(self.hits),
+            "misses": dict(self.misses),
+            "hit_rate": {k: round(self.hits[k] / ((self.hits[k] + self.misses[k]) or 1), 3) for k in kinds},
+        }
+
+def create_cache_backend():
+    if CACHE_BACKEND == "sqlite":
+        return SqliteCacheBackend(CACHE_PATH)
+    if CACHE_BACKEND == "memory":
+        return MemoryCacheBackend(CACHE_MAX_BYTES)
+    return None
+
+CACHE = TTLCache(create_cache_backend(), CACHE_TTLS)
+
+# 업스트림별 동시 실행 제한 (광고 API / 검색결과 렌더링 / 오픈API 도서·쇼핑)
+AD_API_CONCURRENCY = int(os.environ.get("AD_API_CONCURRENCY", 4))
+SERP_CONCURRENCY = int(os.environ.get("SERP_CONCURRENCY", BROWSER_POOL_SIZE))
+OPENAPI_CONCURRENCY = int(os.environ.get("OPENAPI_CONCURRENCY", 4))
+SEARCH_HTTP_CONCURRENCY = int(os.environ.get("SEARCH_HTTP_CONCURRENCY", 4))
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", 8))
+
+UPSTREAM_LIMITS = {
+    "ad": threading.BoundedSemaphore(AD_API_CONCURRENCY),
+    "serp": threading.BoundedSemaphore(SERP_CONCURRENCY),
+    "openapi": threading.BoundedSemaphore(OPENAPI_CONCURRENCY),
+    "search": threading.BoundedSemaphore(SEARCH_HTTP_CONCURRENCY),
+}
+
+# 키워드 하나 안에서 서로 독립적인 단계(검색량, 스토어 순위)를 병렬로 돌리는 풀
+STAGE_EXECUTOR = ThreadPoolExecutor(max_workers=BATCH_WORKERS * 2, thread_name_prefix="stage")
+
+# 키워드 도구 API는 hintKeywords 를 한 번에 최대 5개까지 받음
+KEYWORDTOOL_MAX_HINTS = int(os.environ.get("KEYWORDTOOL_MAX_HINTS", 5))
+
+def volume_key(keyword):
+    return keyword.replace(" ", "").lower()
+
+# --- 키워드 정규화 (전각/공백/대소문자/접미사만 다른 키워드는 같은 키워드로 보고 한 번만 분석) ---
+KEYWORD_STRIP_SUFFIXES = tuple(
+    unicodedata.normalize("NFKC", s).casefold().replace(" ", "")
+    for s in os.environ.get("KEYWORD_STRIP_SUFFIXES", "책").split(",") if s.strip()
+)
+
+def normalize_keyword(keyword):
+    """실제로 검색에 쓰는 형태: NFKC 정규화 + 앞뒤 공백 제거 + 연속 공백은 하나로"""
+    return " ".join(unicodedata.normalize("NFKC", keyword).split())
+
+def keyword_key(keyword):
+    """같은 키워드인지 판단하는 키 (대소문자, 공백, 끝의 접미사 무시)"""
+    key = normalize_keyword(keyword).casefold().replace(" ", "")
+    for suffix in KEYWORD_STRIP_SUFFIXES:
+        if key.endswith(suffix) and len(key) > len(suffix):
+            return key[:-len(suffix)]
+    return key
+
+def parse_volume_item(item):
+    pc = item.get('monthlyPcQcCnt', 0)
+    mo = item.get('monthlyMobileQcCnt', 0)
+    if isinstance(pc, str): pc = 0 # "< 10" 같은 문자열은 0 처리
+    if isinstance(mo, str): mo = 0
+    return pc + mo
+
+def fetch_keywordtool(hints, deadline=None):
+    """hintKeywords 여러 개로 한 번 호출하고, 돌아온 relKeyword 전체를 정규화 키로 색인"""
+    uri = '/keywordstool'
+    params = {'hintKeywords': ",".join(hints), 'showDetail': '1'}
+    headers = get_ad_header('GET', uri)
+    with UPSTREAM_LIMITS["ad"], timed_stage("keywordstool"):
+        res = http_request("GET", f"{NAVER_AD_API_BASE}{uri}", deadline=deadline, limiter=RATE_LIMITERS["ad"],
+                           params=params, headers=headers)
+        res.raise_for_status() # 실패 응답을 "검색량 0"으로 착각하지 않도록
+
+    index = {}
+    for item in res.json().get('keywordList', []):
+        key = volume_key(item.get('relKeyword', ''))
+        if key and key not in index:
+            index[key] = parse_volume_item(item)
+    return index
+
+def keywordtool_rejected(error):
+    """힌트 키워드 때문에 거절된 경우(400). 인증/설정 오류(401/403/404)나 5xx/시간 초과는 나눠서 다시 보내도 소용없음"""
+    res = getattr(error, "response", None)
+    return isinstance(error, requests.HTTPError) and res is not None and res.status_code == 400
+
+def resolve_search_volumes(keywords, on_resolved=None, use_cache=True, deadline=None):
+    """키워드 목록의 월간 검색량을 최소한의 API 호출로 조회 (조회에 실패한 키워드는 None)
+
+    응답에 섞여 오는 다른 키워드의 검색량으로 대기 중인 키워드를 먼저 채우고,
+    남은 키워드만 다음 호출의 hintKeywords 로 보낸다.
+    deadline 을 주면 모든 호출이 그 안에서 끝나야 하고, 없으면 묶음마다 새 deadline 을 쓴다.
+    """
+    pending = {}
+    for keyword in keywords:
+        key = volume_key(keyword)
+        if key and key not in pending:
+            pending[key] = keyword.replace(" ", "")
+
+    volumes = {}
+    if use_cache:
+        cached = {}
+        for key in pending:
+            volume = CACHE.get("volume", key)
+            if volume is not None:
+                cached[key] = volume
+        for key in cached:
+            pending.pop(key)
+        volumes.update(cached)
+        if on_resolved and cached:
+            on_resolved(cached)
+
+    retry_chunks = deque() # 실패한 묶음을 반으로 나눈 것들 (먼저 처리)
+    while pending:
+        chunk = retry_chunks.popleft() if retry_chunks else list(pending)[:KEYWORDTOOL_MAX_HINTS]
+        chunk = [key for key in chunk if key in pending] # 그 사이 연관 키워드로 채워졌을 수 있음
+        if not chunk:
+            continue
+        try:
+            index = fetch_keywordtool([pending[key] for key in chunk], deadline=deadline or new_deadline())
+            failed = False
+        except Exception as e:
+            index = {}
+            failed = True
+            # 힌트 하나가 거절(4xx)되면 묶음 전체가 실패하므로, 반으로 나눠 다시 시도해서 문제 키워드만 실패 처리
+            if len(chunk) > 1 and keywordtool_rejected(e):
+                half = len(chunk) // 2
+                retry_chunks.appendleft(chunk[half:])
+                retry_chunks.appendleft(chunk[:half])
+                continue
+
+        # 함께 딸려온 연관 키워드 검색량도 캐시에 넣어두면 다음 배치에서 재사용됨
+        for key, volume in index.items():
+            CACHE.set("volume", key, volume)
+
+        resolved = {key: index[key] for key in pending if key in index}
+        for key in chunk:
+            if key not in resolved:
+                if failed:
+                    resolved[key] = None # 조회 실패. 0 으로 착각해서 등급을 매기거나 저장하지 않도록 구분
+                else:
+                    resolved[key] = 0 # 요청했는데 응답에 없으면 0
+                    CACHE.set("volume", key, 0)
+        for key in resolved:
+            pending.pop(key, None)
+        volumes.update(resolved)
+        if on_resolved:
+            on_resolved(resolved)
+    return volumes
+
+def get_search_volume(keyword, use_cache=True, deadline=None, labels=None):
+    """labels 를 넘기면 캐시에서 찾았을 때 labels["cache"] = "hit" 으로 표시"""
+    if use_cache:
+        volume = CACHE.get("volume", volume_key(keyword))
+        if volume is not None:
+            if labels is not None:
+                labels["cache"] = "hit"
+            return volume
+    return resolve_search_volumes([keyword], use_cache=False, deadline=deadline).get(volume_key(keyword))
+
+def get_serp_html(pc_link, deadline=None):
+    RATE_LIMITERS["search"].acquire(deadline)
+    timeout = BROWSER_ACQUIRE_TIMEOUT if deadline is None else max(0, min(BROWSER_ACQUIRE_TIMEOUT, deadline - time.monotonic()))
+    with UPSTREAM_LIMITS["serp"]:
+        return get_html_with_selenium(pc_link, timeout=timeout)
+
+# auto: 일반 HTTP 요청으로 먼저 판정하고 애매하면 브라우저 / http: HTTP만 / browser: 항상 브라우저
+SERP_ENGINE = os.environ.get("SERP_ENGINE", "auto").lower()
+if BROWSER_WARM and SERP_ENGINE != "http":
+    threading.Thread(target=BROWSER_POOL.warm, name="browser-warm", daemon=True).start()
+SERP_HTTP_HEADERS = {
+    "User-Agent": USER_AGENT,
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "ko-KR,ko;q=0.9,en-US;q=0.8,en;q=0.7",
+}
+SERP_ENGINE_STATS = Counter()
+
+def get_serp_html_http(pc_link, deadline=None):
+    with UPSTREAM_LIMITS["search"], timed_stage("serp_http") as stage:
+        res = http_request("GET", pc_link, deadline=deadline, limiter=RATE_LIMITERS["search"], headers=SERP_HTTP_HEADERS)
+        if res.status_code != 200:
+            stage["outcome"] = f"http_{res.status_code}"
+    if res.status_code != 200:
+        return ""
+    return res.text
+
+def serp_needs_browser(features):
+    # 결과 영역이 없거나(빈 응답/차단), 판매처 수도 도서 카드도 못 찾은 애매한 경우
+    if not features["main_pack"]:
+        return True
+    return not (features["seller_count"] or features["seller_word"] or features["book_card"])
+
+def default_serp_parser():
+    # lxml 이 설치돼 있으면 훨씬 빠르므로 우선 사용, 없으면 기본 html.parser
     try:
-        uri = '/keywordstool'
-        clean_keyword = keyword.replace(" ", "")
-        params = {'hintKeywords': clean_keyword, 'showDetail': '1'}
-        headers = get_ad_header('GET', uri)
-        res = requests.get(f"https://api.naver.com{uri}", params=params, headers=headers, timeout=5)
-        
-        if res.status_code == 200:
-            data_list = res.json().get('keywordList', [])
-            for item in data_list:
-                api_kw = item.get('relKeyword', '').replace(" ", "")
-                if api_kw.lower() == clean_keyword.lower():
-                    pc = item.get('monthlyPcQcCnt', 0)
-                    mo = item.get('monthlyMobileQcCnt', 0)
-                    if isinstance(pc, str): pc = 0
-                    if isinstance(mo, str): mo = 0
-                    search_volume = pc + mo
+        import lxml  # noqa: F401
+        return "lxml"
+    except ImportError:
+        return "html.parser"
+
+SERP_PARSER = os.environ.get("SERP_PARSER", "") or default_serp_parser()
+MAIN_PACK_ONLY = SoupStrainer(id="main_pack") # 문서 전체 대신 #main_pack 하위만 트리로 만듦
+SELLER_PATTERN = re.compile(r'(판매처|판매자|판매몰|쇼핑몰)\s*([\d,]+)')
+BOOK_CARD_CLASS = re.compile(r'cs_book|sp_book')
+SUBJECT_TITLE_CLASS = re.compile(r'api_title|title')
+
+def extract_serp_features(html_text, parser=None):
+    """검색결과 HTML에서 등급 판정에 필요한 정보만 뽑아냄 (검색량과 무관해서 캐시 가능)"""
+    main_pack = None
+    if "main_pack" in html_text:
+        soup = BeautifulSoup(html_text, parser or SERP_PARSER, parse_only=MAIN_PACK_ONLY)
+        main_pack = soup.find(id="main_pack")
+
+    if not main_pack:
+        blocked = "captcha" in html_text.lower() or "비정상적인" in html_text
+        return {"main_pack": False, "blocked": blocked}
+
+    features = {"main_pack": True, "blocked": False, "seller_word": "", "seller_count": 0, "book_card": False}
+    main_text = main_pack.get_text(separator=" ", strip=True)
+    match = SELLER_PATTERN.search(main_text)
+    if match:
+        features["seller_word"] = match.group(1)
+        features["seller_count"] = int(match.group(2).replace(',', ''))
+    elif main_pack.find(class_=BOOK_CARD_CLASS):
+        features["book_card"] = True
+    else:
+        for bx in main_pack.find_all("div", class_="api_subject_bx"):
+            title_tag = bx.find(class_=SUBJECT_TITLE_CLASS)
+            if title_tag:
+                title_text = title_tag.get_text(strip=True).replace(" ", "")
+                if "도서" in title_text or "책정보" in title_text:
+                    features["book_card"] = True
                     break
-    except:
-        search_volume = 0
+    return features
+
+def serp_needs_volume(features):
+    # 단독 노출된 도서 카드만 검색량으로 A / C(검색량 부족) 가 갈림. 나머지 등급은 검색량과 무관
+    return bool(features["main_pack"] and not (features["seller_count"] or features["seller_word"]) and features["book_card"])
 
-    pc_link = f"https://search.naver.com/search.naver?where=nexearch&query={urllib.parse.quote(keyword)}"
+def grade_serp_features(features, search_volume, min_search_volume):
     grade = ""
     reason = ""
     seller_count = 0
-    shipping_fee = "-" 
 
-    # --- 여기서부터 셀레니움을 활용하도록 변경됨 ---
-    try:
-        html_text = get_html_with_selenium(pc_link)
-        soup = BeautifulSoup(html_text, "html.parser")
-        main_pack = soup.find(id="main_pack")
-        
-        if not main_pack:
-            if "captcha" in html_text.lower() or "비정상적인" in html_text:
-                grade = "오류"
-                reason = "네이버 봇 차단 (일시적 접근 제한)"
-            else:
-                grade = "C (검색불가)"
-                reason = "도서 검색결과 없음"
+    if not features["main_pack"]:
+        if features["blocked"]:
+            grade = "오류"
+            reason = BOT_BLOCK_REASON
         else:
-            main_text = main_pack.get_text(separator=" ", strip=True)
-            match = re.search(r'(판매처|판매자|판매몰|쇼핑몰)\s*([\d,]+)', main_text)
-            if match:
-                seller_word = match.group(1)
-                seller_count = int(match.group(2).replace(',', ''))
-                grade = "B (일반)"
-                reason = f"대표카드 묶임 ({seller_word} {seller_count}개)"
-            else:
-                is_book_card_exist = False
-                if main_pack.find(class_=re.compile(r'cs_book|sp_book')):
-                    is_book_card_exist = True
-                else:
-                    for bx in main_pack.find_all("div", class_="api_subject_bx"):
-                        title_tag = bx.find(class_=re.compile(r'api_title|title'))
-                        if title_tag:
-                            title_text = title_tag.get_text(strip=True).replace(" ", "")
-                            if "도서" in title_text or "책정보" in title_text:
-                                is_book_card_exist = True
-                                break
-                
-                if is_book_card_exist:
-                    if search_volume >= min_search_volume:
-                        grade = "A (황금 🏆)"
-                        reason = "대표카드 아님 (단독 노출)"
-                    else:
-                        grade = "C (검색량 부족)"
-                        reason = f"단독 노출 (단, 검색량 {min_search_volume} 미만)"
+            grade = "C (검색불가)"
+            reason = "도서 검색결과 없음"
+    elif features["seller_count"] or features["seller_word"]:
+        seller_word = features["seller_word"]
+        seller_count = features["seller_count"]
+        grade = "B (일반)"
+        reason = f"대표카드 묶임 ({seller_word} {seller_count}개)"
+    elif features["book_card"]:
+        if search_volume >= min_search_volume:
+            grade = "A (황금 🏆)"
+            reason = "대표카드 아님 (단독 노출)"
+        else:
+            grade = "C (검색량 부족)"
+            reason = f"단독 노출 (단, 검색량 {min_search_volume} 미만)"
+    else:
+        grade = "C (검색불가)"
+        reason = "도서 영역 없음"
+
+    return grade, reason, seller_count
+
+def classify_serp(html, search_volume, min_search_volume, parser=None):
+    """검색결과 HTML 하나를 (등급, 이유, 판매처 수) 로 판정하는 순수 함수"""
+    return grade_serp_features(extract_serp_features(html, parser=parser), search_volume, min_search_volume)
+
+# --- 검색결과 봇 차단 서킷 브레이커 ---
+SERP_BREAKER_WINDOW = float(os.environ.get("SERP_BREAKER_WINDOW", 60))       # 차단 비율을 보는 구간(초)
+SERP_BREAKER_MIN_CALLS = int(os.environ.get("SERP_BREAKER_MIN_CALLS", 5))
+SERP_BREAKER_THRESHOLD = float(os.environ.get("SERP_BREAKER_THRESHOLD", 0.3)) # 이 비율 이상 차단되면 열림
+SERP_BREAKER_COOLDOWN = float(os.environ.get("SERP_BREAKER_COOLDOWN", 30))    # 열릴 때마다 두 배씩 늘어남
+SERP_BREAKER_COOLDOWN_MAX = float(os.environ.get("SERP_BREAKER_COOLDOWN_MAX", 900))
+SERP_MAX_REQUEUE = int(os.environ.get("SERP_MAX_REQUEUE", 3))
+BOT_BLOCK_REASON = "네이버 봇 차단 (일시적 접근 제한)"
+
+class CircuitOpen(Exception):
+    pass
+
+class CircuitBreaker:
+    """최근 window 초 동안의 차단 비율이 threshold 를 넘으면 cooldown 동안 요청을 멈춤
+
+    cooldown 이 끝나면 한 건만 시험 삼아 보내보고(half-open), 또 막히면 cooldown 을 두 배로 늘려 다시 연다.
+    """
+
+    def __init__(self, window, min_calls, threshold, cooldown, cooldown_max):
+        self.window = window
+        self.min_calls = min_calls
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.cooldown_max = cooldown_max
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.open_until = 0.0
+        self.opened = 0
+        self._outcomes = deque()
+        self._probing = False
+        self._waiters = [] # 닫히면 실행할 콜백 (차단돼서 다시 줄 세운 키워드)
+        self._changed = threading.Condition()
+
+    def before_call(self, deadline=None):
+        """요청해도 되는 상태가 될 때까지 대기. deadline 안에 안 되면 CircuitOpen
+
+        half-open 의 시험 요청이면 True (결과를 record 하지 못하면 release_probe 로 돌려놔야 함)
+        """
+        with self._changed:
+            while True:
+                now = time.monotonic()
+                if self.state == "open" and now >= self.open_until:
+                    self.state = "half_open"
+                if self.state == "closed":
+                    return False
+                if self.state == "half_open" and not self._probing:
+                    self._probing = True
+                    return True
+                wait = max(self.open_until - now, 0.5) if self.state == "open" else 0.5
+                if deadline is not None and now + wait > deadline:
+                    raise CircuitOpen(f"차단 해제 대기 ({int(max(self.open_until - now, 0))}초)")
+                self._changed.wait(timeout=wait)
+
+    def record(self, blocked):
+        callbacks = []
+        with self._changed:
+            now = time.monotonic()
+            if self.state == "half_open" and self._probing:
+                self._probing = False
+                if blocked:
+                    self._open(now, escalate=True)
                 else:
-                    grade = "C (검색불가)"
-                    reason = "도서 영역 없음"
+                    self.state = "closed"
+                    self.cooldown = self.base_cooldown
+                    self._outcomes.clear()
+                    callbacks, self._waiters = self._waiters, []
+                self._changed.notify_all()
+            else:
+                self._outcomes.append((now, blocked))
+                while self._outcomes and self._outcomes[0][0] < now - self.window:
+                    self._outcomes.popleft()
+                blocked_count = sum(1 for _, b in self._outcomes if b)
+                if (self.state == "closed" and len(self._outcomes) >= self.min_calls
+                        and blocked_count / len(self._outcomes) >= self.threshold):
+                    self._open(now, escalate=False)
+        for callback in callbacks:
+            callback()
+
+    def release_probe(self, release_waiters=True):
+        """시험 요청을 결과 없이 돌려놓음. release_waiters=False 는 바로 다음 요청이 이어지는 경우 (auto 의 브라우저 재시도)"""
+        callbacks = []
+        with self._changed:
+            if self._probing:
+                self._probing = False
+                # 줄 서 있던 키워드를 다시 흘려보내야 그중 하나가 다음 시험 요청이 됨 (안 그러면 아무도 before_call 을 부르지 않음)
+                if release_waiters:
+                    callbacks, self._waiters = self._waiters, []
+                self._changed.notify_all()
+        for callback in callbacks:
+            callback()
+
+    def _open(self, now, escalate):
+        if escalate:
+            self.cooldown = min(self.cooldown * 2, self.cooldown_max)
+        self.state = "open"
+        self.open_until = now + self.cooldown
+        self.opened += 1
+        # 아무도 요청하지 않아도 cooldown 이 끝나면 대기 중인 키워드를 다시 흘려보냄
+        timer = threading.Timer(self.cooldown, self._release_waiters)
+        timer.daemon = True
+        timer.start()
+
+    def _release_waiters(self):
+        with self._changed:
+            if self.state == "open" and time.monotonic() < self.open_until:
+                return
+            callbacks, self._waiters = self._waiters, []
+            self._changed.notify_all()
+        for callback in callbacks:
+            callback()
+
+    def call_when_closed(self, callback):
+        with self._changed:
+            if self.state != "closed":
+                self._waiters.append(callback)
+                return
+            delay = self.cooldown
+        # 아직 열리진 않았어도 방금 막힌 키워드를 바로 다시 보내지 않도록 cooldown 만큼 늦춤
+        timer = threading.Timer(delay, callback)
+        timer.daemon = True
+        timer.start()
+
+    def stats(self):
+        with self._changed:
+            blocked_count = sum(1 for _, b in self._outcomes if b)
+            return {
+                "state": self.state,
+                "cooldown": self.cooldown,
+                "open_for": round(max(self.open_until - time.monotonic(), 0), 1) if self.state == "open" else 0,
+                "opened": self.opened,
+                "window_calls": len(self._outcomes),
+                "window_block_rate": round(blocked_count / len(self._outcomes), 3) if self._outcomes else 0.0,
+                "requeued_waiting": len(self._waiters),
+            }
+
+SERP_BREAKER = CircuitBreaker(SERP_BREAKER_WINDOW, SERP_BREAKER_MIN_CALLS, SERP_BREAKER_THRESHOLD,
+                              SERP_BREAKER_COOLDOWN, SERP_BREAKER_COOLDOWN_MAX)
+
+def is_bot_blocked(result):
+    return result.get("grade") == "오류" and result.get("reason", "").startswith("네이버 봇 차단")
+
+def guarded_serp_features(fetch_html, pc_link, deadline=None, record_blocked=True):
+    """서킷 브레이커를 거쳐서 HTML 을 받아오고 차단 여부를 기록
+
+    record_blocked=False 면 차단된 결과는 비율에 넣지 않음 (auto 에서 브라우저로 다시 받을 HTTP 시도)
+    """
+    probe = SERP_BREAKER.before_call(deadline)
+    try:
+        html_text = fetch_html(pc_link, deadline=deadline)
+        with timed_stage("serp_parse") as stage:
+            features = extract_serp_features(html_text)
+            if features["blocked"]:
+                stage["outcome"] = "blocked"
+    except Exception:
+        if probe:
+            SERP_BREAKER.release_probe() # 차단이 아닌 오류는 비율에 넣지 않음
+        raise
+    if features["blocked"] and not record_blocked:
+        if probe:
+            SERP_BREAKER.release_probe(release_waiters=False)
+    else:
+        SERP_BREAKER.record(features["blocked"])
+    return features
+
+def fetch_serp_features(pc_link, deadline=None):
+    """(features, 사용한 엔진) 을 돌려줌"""
+    if SERP_ENGINE != "browser":
+        try:
+            # auto 에서는 HTTP 가 막혀도 브라우저로 다시 받으므로, 브라우저를 지키는 브레이커에는 최종 결과만 기록
+            features = guarded_serp_features(get_serp_html_http, pc_link, deadline=deadline,
+                                             record_blocked=SERP_ENGINE == "http")
+        except CircuitOpen:
+            raise
+        except Exception:
+            if SERP_ENGINE == "http":
+                raise
+            features = None
+        if SERP_ENGINE == "http" or (features is not None and not serp_needs_browser(features)):
+            SERP_ENGINE_STATS["http"] += 1
+            return features, "http"
+        SERP_ENGINE_STATS["fallback"] += 1
+
+    SERP_ENGINE_STATS["browser"] += 1
+    return guarded_serp_features(get_serp_html, pc_link, deadline=deadline), "browser"
+
+def get_serp_features(keyword, pc_link, use_cache=True, deadline=None):
+    features = CACHE.get("serp", keyword) if use_cache else None
+    if features is not None:
+        return features, "cache"
+    features, engine = fetch_serp_features(pc_link, deadline=deadline)
+    if not features["blocked"]: # 봇 차단 결과는 캐시하지 않음
+        CACHE.set("serp", keyword, features)
+    return features, engine
+
+def serp_engine_stats():
+    stats = dict(SERP_ENGINE_STATS)
+    attempts = SERP_ENGINE_STATS["http"] + SERP_ENGINE_STATS["fallback"]
+    stats["fallback_rate"] = round(SERP_ENGINE_STATS["fallback"] / attempts, 3) if attempts else 0.0
+    return stats
+
+# --- ISBN 조회 (제목 -> ISBN-13 로컬 색인 + 같은 제목 동시 조회 합치기) ---
+ISBN_INDEX_PATH = os.environ.get("ISBN_INDEX_PATH", "bookall_isbn.sqlite3")
+
+def isbn13_check_digit(first12):
+    total = sum(int(d) * (1 if i % 2 == 0 else 3) for i, d in enumerate(first12))
+    return str((10 - total % 10) % 10)
+
+def is_valid_isbn13(candidate):
+    return (len(candidate) == 13 and candidate.isdigit() and candidate[:3] in ("978", "979")
+            and isbn13_check_digit(candidate[:12]) == candidate[12])
+
+def to_isbn13(candidate):
+    """검증된 ISBN-13 을 돌려줌. 체크섬이 맞는 ISBN-10 이면 ISBN-13 으로 변환, 아니면 None"""
+    candidate = candidate.replace("-", "").strip().upper()
+    if is_valid_isbn13(candidate):
+        return candidate
+    if len(candidate) == 10 and candidate[:9].isdigit() and (candidate[9].isdigit() or candidate[9] == "X"):
+        total = sum((10 - i) * int(d) for i, d in enumerate(candidate[:9])) + (10 if candidate[9] == "X" else int(candidate[9]))
+        if total % 11 == 0:
+            return "978" + candidate[:9] + isbn13_check_digit("978" + candidate[:9])
+    return None
+
+def isbn_title_key(keyword):
+    title = normalize_keyword(keyword)
+    if title.endswith("책") and len(title) > 1: title = title[:-1]
+    return volume_key(title)
+
+def search_book_isbn(query, deadline=None):
+    api_headers = {"X-Naver-Client-Id": NAVER_CLIENT_ID, "X-Naver-Client-Secret": NAVER_CLIENT_SECRET}
+    book_api_url = f"{NAVER_OPENAPI_BASE}/v1/search/book.json?query={urllib.parse.quote(query)}&display=20"
+    with UPSTREAM_LIMITS["openapi"], timed_stage("book_api"):
+        book_res = http_request("GET", book_api_url, deadline=deadline, limiter=RATE_LIMITERS["book"], headers=api_headers)
+        book_res.raise_for_status()
+
+    for item in book_res.json().get('items', []):
+        # "ISBN10 ISBN13" 형태라서 뒤에서부터 확인
+        for candidate in reversed(item.get('isbn', '').split()):
+            isbn = to_isbn13(candidate)
+            if isbn:
+                return isbn
+    return None
+
+def lookup_isbn(keyword, deadline=None):
+    api_keyword = keyword
+    if api_keyword.endswith("책") and len(api_keyword) > 1: api_keyword = api_keyword[:-1]
+    isbn = search_book_isbn(api_keyword, deadline=deadline)
+    if isbn is None and api_keyword != keyword:
+        isbn = search_book_isbn(keyword, deadline=deadline)
+    return isbn or "-"
+
+class IsbnResolver:
+    def __init__(self, path, ttl, executor):
+        self.db = SqliteDB(path, schema=(
+            "CREATE TABLE IF NOT EXISTS isbn_index (title TEXT PRIMARY KEY, isbn TEXT NOT NULL, updated_at REAL NOT NULL)",
+        ))
+        self.ttl = ttl
+        self.executor = executor
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.api_calls = 0
+        self.shared = 0
+
+    def lookup_index(self, key):
+        row = self.db.conn().execute("SELECT isbn, updated_at FROM isbn_index WHERE title = ?", (key,)).fetchone()
+        if row is None or time.time() - row[1] >= self.ttl:
+            return None
+        return row[0]
+
+    def resolve(self, keyword, use_cache=True, deadline=None, labels=None):
+        labels = {} if labels is None else labels
+        key = isbn_title_key(keyword)
+        if use_cache:
+            isbn = self.lookup_index(key)
+            if isbn is not None:
+                labels["cache"] = "hit"
+                return isbn
+
+        # 같은 제목을 이미 누가 조회 중이면 그 결과를 같이 기다림
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+            else:
+                self.shared += 1
+        if not owner:
+            labels["cache"] = "shared"
+            return future.result()
+
+        try:
+            with self._lock:
+                self.api_calls += 1
+            isbn = lookup_isbn(keyword, deadline=deadline)
+            self.db.conn().execute("INSERT OR REPLACE INTO isbn_index (title, isbn, updated_at) VALUES (?, ?, ?)",
+                                 (key, isbn, time.time()))
+        except Exception:
+            isbn = "조회 실패"
+            labels["outcome"] = "error"
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        future.set_result(isbn)
+        return isbn
+
+    def prefetch(self, keywords, use_cache=True):
+        """여러 제목의 ISBN 을 미리 병렬로 조회해 색인에 채워둠 (같은 제목은 한 번만)"""
+        keys = {}
+        for keyword in keywords:
+            keys.setdefault(isbn_title_key(keyword), keyword)
+        return [self.executor.submit(lambda k=keyword: self.resolve(k, use_cache=use_cache, deadline=new_deadline()))
+                for key, keyword in keys.items() if not (use_cache and self.lookup_index(key) is not None)]
+
+    def stats(self):
+        return {"api_calls": self.api_calls, "shared_inflight": self.shared}
+
+ISBN_EXECUTOR = ThreadPoolExecutor(max_workers=OPENAPI_CONCURRENCY, thread_name_prefix="isbn")
+ISBN_RESOLVER = IsbnResolver(ISBN_INDEX_PATH, CACHE_TTLS["isbn"], ISBN_EXECUTOR)
+
+def get_isbn(keyword, use_cache=True, deadline=None, labels=None):
+    return ISBN_RESOLVER.resolve(keyword, use_cache=use_cache, deadline=deadline, labels=labels)
+
+# --- 쇼핑 검색 순위 스캐너 ---
+STORE_MALL_NAMES = [m.strip() for m in os.environ.get("STORE_MALL_NAMES", "스터디박스").split(",") if m.strip()]
+SHOP_PAGE_SIZE = 100
+SHOP_MAX_RANK = 500
+
+class RankScanError(Exception):
+    pass
+
+class RankScanner:
+    """shop.json 페이지를 동시에 요청하고, 가장 앞 페이지의 순위가 확정되면 바로 멈춤
+
+    여러 몰 이름을 한 번의 스캔으로 같이 찾는다.
+    """
 
+    def __init__(self, mall_names, limiter, executor, page_size=SHOP_PAGE_SIZE, max_rank=SHOP_MAX_RANK):
+        self.mall_names = list(mall_names)
+        self.limiter = limiter
+        self.executor = executor
+        self.page_size = page_size
+        self.starts = list(range(1, max_rank + 1, page_size))
+        self.out_of_range = f"{max_rank}위 밖"
+
+    def fetch_page(self, keyword, start, deadline=None, stop=None):
+        api_headers = {"X-Naver-Client-Id": NAVER_CLIENT_ID, "X-Naver-Client-Secret": NAVER_CLIENT_SECRET}
+        api_url = f"{NAVER_OPENAPI_BASE}/v1/search/shop.json?query={urllib.parse.quote(keyword)}&display={self.page_size}&start={start}"
+        with UPSTREAM_LIMITS["openapi"], timed_stage("shop_page"):
+            api_res = http_request("GET", api_url, deadline=deadline, limiter=self.limiter, stop=stop, headers=api_headers)
+            if api_res.status_code != 200:
+                raise RankScanError(f"shop.json {api_res.status_code}")
+        return api_res.json().get('items', [])
+
+    def scan(self, keyword, deadline=None):
+        """몰 이름별 순위(int 또는 None)를 돌려줌. 첫 페이지부터 실패하면 RankScanError"""
+        stop = threading.Event() # 순위가 확정되면 토큰을 기다리던 페이지도 요청하지 않게 함
+        futures = {self.executor.submit(self.fetch_page, keyword, start, deadline, stop): start for start in self.starts}
+        pages = {}
+        try:
+            for future in as_completed(futures):
+                start = futures[future]
+                try:
+                    pages[start] = future.result()
+                except Exception:
+                    if start == self.starts[0]:
+                        raise RankScanError("첫 페이지 조회 실패")
+                    pages[start] = [] # 뒤쪽 페이지 실패는 해당 페이지에 없는 것으로 처리
+                ranks, settled = self._ranks_so_far(pages)
+                if settled:
+                    return ranks
+            return self._ranks_so_far(pages)[0]
+        finally:
+            stop.set()
+            for future in futures:
+                future.cancel() # 아직 시작 안 한 페이지 요청은 취소
+
+    def _ranks_so_far(self, pages):
+        # 앞에서부터 연속으로 받은 페이지 안에서만 순위를 확정할 수 있음
+        ranks = {name: None for name in self.mall_names}
+        for start in self.starts:
+            if start not in pages:
+                return ranks, False
+            for idx, item in enumerate(pages[start]):
+                mall_name = item.get('mallName', '')
+                for name in self.mall_names:
+                    if ranks[name] is None and name in mall_name:
+                        ranks[name] = start + idx
+            if all(rank is not None for rank in ranks.values()):
+                return ranks, True
+        return ranks, True
+
+    def format_ranks(self, ranks):
+        return {name: (str(rank) if rank is not None else self.out_of_range) for name, rank in ranks.items()}
+
+RANK_EXECUTOR = ThreadPoolExecutor(max_workers=OPENAPI_CONCURRENCY * 2, thread_name_prefix="rank")
+RANK_SCANNER = RankScanner(STORE_MALL_NAMES, RATE_LIMITERS["shop"], RANK_EXECUTOR)
+
+def get_store_ranks(keyword, use_cache=True, deadline=None, labels=None):
+    labels = {} if labels is None else labels
+    cache_key = f"{keyword}|{','.join(RANK_SCANNER.mall_names)}"
+    cached = CACHE.get("rank", cache_key) if use_cache else None
+    if cached is not None:
+        labels["cache"] = "hit"
+        return cached
+
+    store_ranks = {name: RANK_SCANNER.out_of_range for name in RANK_SCANNER.mall_names}
+    try:
+        if NAVER_CLIENT_ID and NAVER_CLIENT_SECRET:
+            store_ranks = RANK_SCANNER.format_ranks(RANK_SCANNER.scan(keyword, deadline=deadline))
+            CACHE.set("rank", cache_key, store_ranks)
+    except RankScanError:
+        store_ranks = {name: "API에러" for name in RANK_SCANNER.mall_names}
+        labels["outcome"] = "error"
+    except Exception:
+        store_ranks = {name: "탐색 실패" for name in RANK_SCANNER.mall_names}
+        labels["outcome"] = "error"
+    return store_ranks
+
+def completed_future(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+def timed_call(stage, timings, fn, *args):
+    with timed_stage(stage, timings) as labels:
+        return fn(*args, labels=labels)
+
+def analyze_book(keyword, fetch_isbn=False, min_search_volume=0, search_volume=None, no_cache=False, stages=None, timings=None):
+    """키워드 하나를 분석
+
+    stages 를 넘기면 그 안에 이미 있는 단계 값(volume/serp/isbn/rank)은 다시 조회하지 않고 쓰고,
+    새로 조회한 단계는 {"value": ..., "at": 시각} 으로 채워 넣는다.
+    timings 를 넘기면 실제로 조회한 단계와 전체(total)의 소요 시간(ms)을 채워 넣는다.
+    """
+    started = time.perf_counter()
+    use_cache = not no_cache
+    deadline = new_deadline()
+    stages = {} if stages is None else stages
+    fetched_at = time.time()
+
+    # 검색량 조회와 스토어 순위 탐색은 검색결과 렌더링과 무관하므로 동시에 시작
+    if "volume" in stages:
+        volume_future = completed_future(stages["volume"]["value"])
+    elif search_volume is None:
+        volume_future = STAGE_EXECUTOR.submit(timed_call, "volume", timings, get_search_volume, keyword, use_cache, deadline)
+    else:
+        volume_future = completed_future(search_volume)
+    if "rank" in stages:
+        rank_future = completed_future(stages["rank"]["value"])
+    else:
+        rank_future = STAGE_EXECUTOR.submit(timed_call, "rank", timings, get_store_ranks, keyword, use_cache, deadline)
+
+    pc_link = f"{NAVER_SEARCH_BASE}/search.naver?where=nexearch&query={urllib.parse.quote(keyword)}"
+    grade = ""
+    reason = ""
+    seller_count = 0
+    shipping_fee = "-" 
+    serp_engine = "-"
+
+    try:
+        if "serp" in stages:
+            features, serp_engine = stages["serp"]["value"], "store"
+        else:
+            with timed_stage("serp", timings) as serp_stage:
+                features, serp_engine = get_serp_features(keyword, pc_link, use_cache=use_cache, deadline=deadline)
+                if serp_engine == "cache":
+                    serp_stage["cache"] = "hit"
+                if features["blocked"]:
+                    serp_stage["outcome"] = "blocked"
+            if not features["blocked"]:
+                stages["serp"] = {"value": features, "at": fetched_at}
+        search_volume = volume_future.result()
+        if search_volume is None and serp_needs_volume(features):
+            grade = "오류"
+            reason = "검색량 조회 실패 (키워드 도구 API)"
+        else:
+            grade, reason, seller_count = grade_serp_features(features, search_volume or 0, min_search_volume)
+    except CircuitOpen as e:
+        grade = "오류"
+        reason = f"네이버 봇 차단 ({e})"
     except Exception as e:
         grade = "오류"
         reason = f"일시적 스크래핑 실패 ({str(e)[:20]})"
-    # --- 여기까지 수정됨 ---
+
+    search_volume = volume_future.result()
+    if search_volume is None:
+        search_volume = 0 # volume 단계를 남기지 않으므로 저장되지 않고 다음 실행에서 다시 조회 (should_store_result)
+    else:
+        stages.setdefault("volume", {"value": search_volume, "at": fetched_at})
 
     isbn = "-"
     if grade == "B (일반)" and fetch_isbn:
-        try:
-            api_headers = {"X-Naver-Client-Id": NAVER_CLIENT_ID, "X-Naver-Client-Secret": NAVER_CLIENT_SECRET}
-            api_keyword = keyword
-            if api_keyword.endswith("책") and len(api_keyword) > 1: api_keyword = api_keyword[:-1]
-            book_api_url = f"https://openapi.naver.com/v1/search/book.json?query={urllib.parse.quote(api_keyword)}&display=20"
-            book_res = requests.get(book_api_url, headers=api_headers, timeout=5)
-            
-            items = []
-            if book_res.status_code == 200: items = book_res.json().get('items', [])
-            if not items and api_keyword != keyword:
-                book_api_url = f"https://openapi.naver.com/v1/search/book.json?query={urllib.parse.quote(keyword)}&display=20"
-                book_res = requests.get(book_api_url, headers=api_headers, timeout=5)
-                if book_res.status_code == 200: items = book_res.json().get('items', [])
-
-            for item in items:
-                isbn_raw = item.get('isbn', '')
-                isbns = isbn_raw.split()
-                found_valid = False
-                for candidate in reversed(isbns):
-                    if candidate.startswith('9') or candidate.startswith('8'):
-                        isbn = candidate
-                        found_valid = True
-                        break
-                if found_valid: break
-        except:
-            isbn = "조회 실패"
+        if "isbn" in stages:
+            isbn = stages["isbn"]["value"]
+        else:
+            isbn = timed_call("isbn", timings, get_isbn, keyword, use_cache, deadline)
+            if isbn != "조회 실패":
+                stages["isbn"] = {"value": isbn, "at": time.time()}
 
-    store_rank = "500위 밖"
-    try:
-        if NAVER_CLIENT_ID and NAVER_CLIENT_SECRET:
-            api_headers = {"X-Naver-Client-Id": NAVER_CLIENT_ID, "X-Naver-Client-Secret": NAVER_CLIENT_SECRET}
-            found_rank = False
-            for start_idx in [1, 101, 201, 301, 401]:
-                api_url = f"https://openapi.naver.com/v1/search/shop.json?query={urllib.parse.quote(keyword)}&display=100&start={start_idx}"
-                api_res = requests.get(api_url, headers=api_headers, timeout=5)
-                if api_res.status_code == 200:
-                    items = api_res.json().get('items', [])
-                    for idx, item in enumerate(items):
-                        if "스터디박스" in item.get('mallName', ''):
-                            store_rank = str(start_idx + idx)
-                            found_rank = True
-                            break
-                else:
-                    if start_idx == 1: store_rank = "API에러"
-                    break
-                if found_rank: break
-                time.sleep(0.1)
-    except:
-        store_rank = "탐색 실패"
+    store_ranks = rank_future.result()
+    if "rank" not in stages and not any(rank in ("API에러", "탐색 실패") for rank in store_ranks.values()):
+        stages["rank"] = {"value": store_ranks, "at": fetched_at}
+
+    elapsed = time.perf_counter() - started
+    METRICS.observe("bookall_keyword_seconds", elapsed, outcome="error" if grade == "오류" else "ok")
+    METRICS.inc("bookall_keywords_total", grade=grade)
+    if timings is not None:
+        timings["total"] = round(elapsed * 1000, 1)
 
     return {
         "keyword": keyword,
@@ -201,9 +1448,721 @@ def analyze_book(keyword, fetch_isbn=False, min_search_volume=0):
         "isbn": isbn,
         "link": pc_link,
         "shipping_fee": shipping_fee,
-        "store_rank": store_rank
+        "store_rank": store_ranks.get(STORE_MALL_NAMES[0], "-") if STORE_MALL_NAMES else "-",
+        "store_ranks": store_ranks,
+        "serp_engine": serp_engine
     }
 
+def should_store_result(result, stages):
+    """오류이거나 검색량을 못 받은 결과(검색량 0 으로 등급만 매긴 것)는 저장소에 넣지 않음"""
+    return result["grade"] != "오류" and "volume" in stages
+
+# --- 스터디박스 웹훅 전송 (디스크 outbox 에 쌓고 백그라운드에서 묶어서 전송) ---
+WEBHOOK_OUTBOX_PATH = os.environ.get("WEBHOOK_OUTBOX_PATH", "bookall_outbox.sqlite3")
+WEBHOOK_BATCH_SIZE = int(os.environ.get("WEBHOOK_BATCH_SIZE", 20)) # 1 이면 예전처럼 결과 하나씩 객체로 전송
+WEBHOOK_LINGER = float(os.environ.get("WEBHOOK_LINGER", 2)) # 묶음이 안 차도 이 시간(초)이 지나면 전송
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get("WEBHOOK_MAX_ATTEMPTS", 8))
+WEBHOOK_RETRY_BASE = float(os.environ.get("WEBHOOK_RETRY_BASE", 2))
+WEBHOOK_RETRY_MAX = float(os.environ.get("WEBHOOK_RETRY_MAX", 300))
+WEBHOOK_SENDING_TIMEOUT = 120 # 'sending' 상태로 이만큼 지나면 죽은 워커가 잡고 있던 것으로 보고 되돌림
+
+class WebhookOutbox:
+    def __init__(self, path):
+        self.db = SqliteDB(path, schema=(
+            """CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT NOT NULL DEFAULT '',
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL)""",
+            "CREATE INDEX IF NOT EXISTS outbox_ready ON outbox (status, next_attempt_at)",
+        ))
+        self._wake = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def enqueue(self, result):
+        now = time.time()
+        with self.db.conn() as conn:
+            cur = conn.execute("INSERT INTO outbox (payload, next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                               (json.dumps(result, ensure_ascii=False), now, now, now))
+        self.start()
+        self._wake.set()
+        return cur.lastrowid
+
+    def status(self, ids):
+        ids = [int(i) for i in ids][:1000]
+        if not ids:
+            return {}
+        rows = self.db.conn().execute(
+            f"SELECT id, status, attempts, last_error FROM outbox WHERE id IN ({','.join('?' * len(ids))})", ids).fetchall()
+        return {row[0]: self.describe(row[1], row[2], row[3]) for row in rows}
+
+    @staticmethod
+    def describe(status, attempts, last_error):
+        if status == "sent":
+            return '성공!'
+        if status == "failed":
+            return f'전송 실패 ({last_error})'
+        if status == "sending":
+            return '전송 중'
+        if attempts:
+            return f'재시도 대기 ({attempts}회 실패: {last_error})'
+        return '대기'
+
+    def has_undelivered(self):
+        if not os.path.exists(self.db.path): # 처음 실행이면 파일을 만들지 않음
+            return False
+        return self.db.conn().execute("SELECT 1 FROM outbox WHERE status IN ('pending', 'sending') LIMIT 1").fetchone() is not None
+
+    def start(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="webhook-outbox", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                delay = self.deliver_ready()
+            except Exception:
+                delay = WEBHOOK_LINGER
+            self._wake.wait(timeout=delay)
+            self._wake.clear()
+
+    def _claim(self):
+        """보낼 묶음을 'sending' 으로 잡아둠. 보낼 게 없으면 (빈 목록, 다음 확인까지 대기 시간)"""
+        conn = self.db.conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE") # 여러 gunicorn 워커가 같은 행을 잡지 않도록
+        try:
+            conn.execute("UPDATE outbox SET status = 'pending' WHERE status = 'sending' AND updated_at < ?",
+                         (now - WEBHOOK_SENDING_TIMEOUT,))
+            ready = conn.execute("SELECT COUNT(*), MIN(created_at) FROM outbox WHERE status = 'pending' AND next_attempt_at <= ?",
+                                 (now,)).fetchone()
+            count, oldest = ready
+            if not count:
+                upcoming = conn.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'").fetchone()[0]
+                conn.execute("COMMIT")
+                return [], (min(max(upcoming - now, 0.1), 30) if upcoming else 30)
+            if count < WEBHOOK_BATCH_SIZE and now - oldest < WEBHOOK_LINGER:
+                conn.execute("COMMIT")
+                return [], WEBHOOK_LINGER - (now - oldest)
+            rows = conn.execute("SELECT id, payload, attempts FROM outbox WHERE status = 'pending' AND next_attempt_at <= ? "
+                                "ORDER BY id LIMIT ?", (now, WEBHOOK_BATCH_SIZE)).fetchall()
+            conn.executemany("UPDATE outbox SET status = 'sending', updated_at = ? WHERE id = ?", [(now, row[0]) for row in rows])
+            conn.execute("COMMIT")
+            return rows, 0
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def deliver_ready(self):
+        """한 묶음을 보내고 다음 시도까지 기다릴 시간(초)을 돌려줌"""
+        webhook_url = os.environ.get("STUDYBOX_WEBHOOK_URL", "").strip()
+        if not webhook_url:
+            return 30
+        rows, delay = self._claim()
+        if not rows:
+            return delay
+
+        payloads = [json.loads(row[1]) for row in rows]
+        body = payloads[0] if WEBHOOK_BATCH_SIZE == 1 else payloads
+        try:
+            res = http_request("POST", webhook_url, deadline=time.monotonic() + 30, json=body)
+            error = "" if res.status_code == 200 else f'서버 거절 ({res.status_code})'
+        except Exception as e:
+            error = f'통신 에러 ({str(e)[:20]})'
+
+        now = time.time()
+        with self.db.conn() as conn:
+            if not error:
+                conn.executemany("UPDATE outbox SET status = 'sent', attempts = attempts + 1, last_error = '', updated_at = ? WHERE id = ?",
+                                 [(now, row[0]) for row in rows])
+            else:
+                updates = []
+                for row_id, _, attempts in rows:
+                    attempts += 1
+                    status = "failed" if attempts >= WEBHOOK_MAX_ATTEMPTS else "pending"
+                    retry_at = now + random.uniform(0.5, 1) * min(WEBHOOK_RETRY_MAX, WEBHOOK_RETRY_BASE * (2 ** attempts))
+                    updates.append((status, attempts, retry_at, error, now, row_id))
+                conn.executemany("UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ? WHERE id = ?",
+                                 updates)
+        return 0
+
+WEBHOOK_OUTBOX = WebhookOutbox(WEBHOOK_OUTBOX_PATH)
+if WEBHOOK_OUTBOX.has_undelivered(): # 재시작 전에 못 보낸 웹훅은 새 결과가 없어도 바로 이어서 보냄
+    WEBHOOK_OUTBOX.start()
+
+def send_webhook(result):
+    result['webhook_status'] = '대기'
+
+    grade = result.get("grade", "")
+
+    if "A" in grade or "B" in grade or "C" in grade:
+        webhook_url = os.environ.get("STUDYBOX_WEBHOOK_URL", "").strip()
+        if not webhook_url:
+            result['webhook_status'] = '환경변수 누락 (전송불가)'
+        else:
+            try:
+                result['webhook_id'] = WEBHOOK_OUTBOX.enqueue(result)
+            except Exception:
+                result['webhook_status'] = '대기열 저장 실패'
+    return result
+
+def refresh_webhook_status(results):
+    ids = [r['webhook_id'] for r in results if r and r.get('webhook_id')]
+    statuses = WEBHOOK_OUTBOX.status(ids) if ids else {}
+    for r in results:
+        if r and r.get('webhook_id') in statuses:
+            r['webhook_status'] = statuses[r['webhook_id']]
+    return results
+
+# --- 분석 결과 저장소 (키워드별 최신 결과 + 배치 작업 진행 상황) ---
+RESULT_STORE_PATH = os.environ.get("RESULT_STORE_PATH", "bookall_results.sqlite3")
+RESULT_MAX_AGE = int(os.environ.get("RESULT_MAX_AGE", 24 * 3600)) # 이 시간 안에 분석한 키워드는 배치에서 건너뜀
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get("JOB_HEARTBEAT_INTERVAL", 10)) # 돌리고 있는 작업의 updated_at 을 갱신하는 간격(초)
+JOB_OWNER_TIMEOUT = float(os.environ.get("JOB_OWNER_TIMEOUT", 60)) # 이만큼 갱신이 없으면 주인 워커가 죽은 것으로 봄
+REFRESH_MODES = ("missing", "stale", "all") # 없거나 오래된 키워드만 / 오래된 단계만 / 전부 다시
+
+def result_key(keyword, fetch_isbn, min_search_volume):
+    return f"{keyword_key(keyword)}|{int(bool(fetch_isbn))}|{int(min_search_volume)}"
+
+def fresh_stages(stages, now=None):
+    """단계별 TTL(CACHE_TTL_*) 안에 있는 단계만 골라냄"""
+    now = now or time.time()
+    return {name: stage for name, stage in stages.items() if now - stage["at"] < CACHE_TTLS.get(name, 0)}
+
+def plan_stored_result(keyword, fetch_isbn, min_search_volume, refresh="missing", max_age=RESULT_MAX_AGE):
+    """(그대로 쓸 저장 결과 또는 None, 재사용할 단계들) 을 돌려줌"""
+    if refresh == "all":
+        return None, {}
+    stored = RESULT_STORE.get_result(keyword, fetch_isbn, min_search_volume)
+    if stored is None:
+        return None, {}
+    if refresh == "stale":
+        return None, fresh_stages(stored["stages"])
+    if max_age and time.time() - stored["updated_at"] < max_age:
+        return stored["result"], {}
+    return None, {}
+
+class ResultStore:
+    def __init__(self, path):
+        self.db = SqliteDB(path, schema=(
+            """CREATE TABLE IF NOT EXISTS results (
+            key TEXT PRIMARY KEY,
+            keyword TEXT NOT NULL,
+            fetch_isbn INTEGER NOT NULL,
+            min_search_volume INTEGER NOT NULL,
+            result TEXT NOT NULL,
+            stages TEXT NOT NULL,
+            updated_at REAL NOT NULL)""",
+            """CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            params TEXT NOT NULL,
+            keywords TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            owner_pid INTEGER NOT NULL DEFAULT 0)""",
+            """CREATE TABLE IF NOT EXISTS job_results (
+            job_id TEXT NOT NULL,
+            idx INTEGER NOT NULL,
+            result TEXT NOT NULL,
+            PRIMARY KEY (job_id, idx))""",
+        ), synchronous="NORMAL", columns={"jobs": [("owner_pid", "INTEGER NOT NULL DEFAULT 0")]})
+
+    def get_result(self, keyword, fetch_isbn, min_search_volume):
+        row = self.db.conn().execute("SELECT result, stages, updated_at FROM results WHERE key = ?",
+                                   (result_key(keyword, fetch_isbn, min_search_volume),)).fetchone()
+        if row is None:
+            return None
+        return {"result": json.loads(row[0]), "stages": json.loads(row[1]), "updated_at": row[2]}
+
+    def save_result(self, keyword, fetch_isbn, min_search_volume, result, stages):
+        self.db.conn().execute(
+            "INSERT OR REPLACE INTO results (key, keyword, fetch_isbn, min_search_volume, result, stages, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (result_key(keyword, fetch_isbn, min_search_volume), keyword, int(bool(fetch_isbn)), int(min_search_volume),
+             json.dumps(result, ensure_ascii=False), json.dumps(stages, ensure_ascii=False), time.time()))
+
+    def create_job(self, job):
+        now = time.time()
+        self.db.conn().execute("INSERT OR REPLACE INTO jobs (job_id, params, keywords, status, created_at, updated_at, owner_pid) "
+                               "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (job.id, json.dumps(job.params()), json.dumps(job.keywords, ensure_ascii=False), job.status,
+                                job.created_at, now, os.getpid()))
+
+    def set_job_status(self, job_id, status):
+        self.db.conn().execute("UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ?", (status, time.time(), job_id))
+
+    def touch_jobs(self, job_ids):
+        """이 프로세스가 돌리고 있는 작업의 하트비트"""
+        now = time.time()
+        self.db.conn().executemany("UPDATE jobs SET updated_at = ? WHERE job_id = ? AND owner_pid = ?",
+                                   [(now, job_id, os.getpid()) for job_id in job_ids])
+
+    def claim_job(self, job_id):
+        """주인이 없어진(하트비트가 끊긴) 작업을 이 프로세스가 가져옴. 다른 워커가 먼저 가져갔으면 False"""
+        now = time.time()
+        cur = self.db.conn().execute(
+            "UPDATE jobs SET owner_pid = ?, updated_at = ? WHERE job_id = ? AND status != 'done' AND (owner_pid = ? OR updated_at < ?)",
+            (os.getpid(), now, job_id, os.getpid(), now - JOB_OWNER_TIMEOUT))
+        return cur.rowcount == 1
+
+    def job_owner(self, job_id):
+        row = self.db.conn().execute("SELECT status, owner_pid, updated_at FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return None if row is None else {"status": row[0], "owner_pid": row[1], "updated_at": row[2]}
+
+    def save_job_result(self, job_id, index, result):
+        self.db.conn().execute("INSERT OR REPLACE INTO job_results (job_id, idx, result) VALUES (?, ?, ?)",
+                             (job_id, index, json.dumps(result, ensure_ascii=False)))
+
+    def job_exists(self, job_id):
+        return self.db.conn().execute("SELECT 1 FROM jobs WHERE job_id = ?", (job_id,)).fetchone() is not None
+
+    def load_job(self, job_id):
+        row = self.db.conn().execute("SELECT params, keywords, status, created_at, owner_pid, updated_at FROM jobs WHERE job_id = ?",
+                                     (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {"params": json.loads(row[0]), "keywords": json.loads(row[1]), "status": row[2],
+                "created_at": row[3], "owner_pid": row[4], "updated_at": row[5]}
+
+    def job_results_since(self, job_id, rowid=0):
+        """rowid 이후에 저장된 (인덱스, 결과) 목록과 마지막 rowid"""
+        rows = self.db.conn().execute("SELECT rowid, idx, result FROM job_results WHERE job_id = ? AND rowid > ? ORDER BY rowid",
+                                      (job_id, rowid)).fetchall()
+        return [(idx, json.loads(result)) for _, idx, result in rows], (rows[-1][0] if rows else rowid)
+
+    def iter_job_results(self, job_id):
+        # 전용 연결로 커서를 열어 한 줄씩 읽음 (결과 전체를 메모리에 올리지 않음)
+        conn = sqlite3.connect(self.db.path, timeout=30)
+        try:
+            for (result,) in conn.execute("SELECT result FROM job_results WHERE job_id = ? ORDER BY idx", (job_id,)):
+                yield json.loads(result)
+        finally:
+            conn.close()
+
+RESULT_STORE = ResultStore(RESULT_STORE_PATH)
+
+def job_owner_alive(owner):
+    # 이 프로세스 pid 로 남아 있는데 메모리에 없으면 재시작 전의 같은 pid 이므로 죽은 것으로 봄
+    return owner["owner_pid"] != os.getpid() and owner["updated_at"] >= time.time() - JOB_OWNER_TIMEOUT
+
+# --- 서버측 일괄 분석 (배치 작업) ---
+BATCH_JOB_RETENTION = int(os.environ.get("BATCH_JOB_RETENTION", 50))
+BATCH_EXECUTOR = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="batch")
+
+class BatchJob:
+    def __init__(self, keywords, fetch_isbn=False, min_search_volume=0, no_cache=False,
+                 refresh="missing", max_age=RESULT_MAX_AGE, job_id=None, created_at=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.keywords = keywords
+        self.fetch_isbn = fetch_isbn
+        self.min_search_volume = min_search_volume
+        self.no_cache = no_cache
+        self.refresh = refresh if refresh in REFRESH_MODES else "missing"
+        self.max_age = max_age
+        self.results = [None] * len(keywords)
+        self.done = 0
+        self.skipped = 0
+        self.status = "queued"
+        self.created_at = created_at or time.time()
+        self.finished_at = None
+        self.completed = [] # 끝난 순서대로 쌓이는 키워드 인덱스 (스트리밍용)
+        self.requeued = 0
+        self.remote = False # 다른 워커가 돌리고 있는 작업을 저장소에서 따라 읽는 중
+        self._synced_rowid = 0
+        self._requeues = Counter()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self.plans = {} # 인덱스 -> (저장된 결과를 그대로 쓸 경우 그 결과, 재사용할 단계들)
+        # 검색량은 배치 전체를 묶어서 조회하고 키워드별 Future 로 나눠줌
+        self.volume_futures = {}
+        # 같은 키워드로 보이는 줄은 처음 나온 줄(대표)만 분석하고 결과를 나머지 줄에 나눠줌
+        self.groups = OrderedDict() # keyword_key -> 그 키를 가진 인덱스 목록 (입력 순서)
+        for index, keyword in enumerate(keywords):
+            self.groups.setdefault(keyword_key(keyword), []).append(index)
+        self.leader_of = [0] * len(keywords)
+        for indices in self.groups.values():
+            for index in indices:
+                self.leader_of[index] = indices[0]
+
+    def params(self):
+        return {"fetch_isbn": self.fetch_isbn, "min_search_volume": self.min_search_volume,
+                "no_cache": self.no_cache, "refresh": self.refresh, "max_age": self.max_age}
+
+    def pending_indices(self):
+        with self._lock:
+            return [i for i, result in enumerate(self.results) if result is None]
+
+    def query(self, index):
+        """index 줄을 분석할 때 실제로 쓰는 키워드 (대표 줄을 정규화한 것)"""
+        return normalize_keyword(self.keywords[self.leader_of[index]])
+
+    def plan_for(self, keyword):
+        return plan_stored_result(keyword, self.fetch_isbn, self.min_search_volume, self.refresh, self.max_age)
+
+    def prepare(self, indices):
+        """저장소를 보고 키워드별 계획을 세운 뒤, 실제로 필요한 검색량만 묶어서 조회"""
+        def on_resolved(resolved):
+            for key, volume in resolved.items():
+                future = self.volume_futures.get(key)
+                if future and not future.done():
+                    future.set_result(volume)
+        try:
+            needs_volume = []
+            likely_b = []
+            for index in indices:
+                keyword = self.query(index)
+                stored, stages = self.plan_for(keyword)
+                self.plans[index] = (stored, stages)
+                if self.fetch_isbn and stored is None and "isbn" not in stages:
+                    previous = RESULT_STORE.get_result(keyword, self.fetch_isbn, self.min_search_volume)
+                    if previous and previous["result"].get("grade") == "B (일반)":
+                        likely_b.append(keyword)
+                if stored is not None:
+                    on_resolved({volume_key(keyword): stored.get("search_volume", 0)})
+                elif "volume" in stages:
+                    on_resolved({volume_key(keyword): stages["volume"]["value"]})
+                else:
+                    needs_volume.append(keyword)
+            # 지난번에 B등급이었던 키워드는 ISBN 을 미리 한꺼번에 조회해 둠
+            if likely_b:
+                ISBN_RESOLVER.prefetch(likely_b, use_cache=not self.no_cache)
+            resolve_search_volumes(needs_volume, on_resolved=on_resolved, use_cache=not self.no_cache)
+        finally:
+            for future in self.volume_futures.values():
+                if not future.done():
+                    future.set_result(None) # 검색량을 못 받은 키워드는 analyze_book 이 직접 다시 조회
+
+    def start(self, indices):
+        leaders = list(OrderedDict.fromkeys(self.leader_of[i] for i in indices))
+        # 대표 줄은 끝났는데 나머지 줄에 아직 못 나눠준 상태로 중단된 경우는 바로 나눠줌
+        finished = [i for i in leaders if self.results[i] is not None]
+        leaders = [i for i in leaders if self.results[i] is None]
+        self.volume_futures = {volume_key(self.query(i)): Future() for i in leaders}
+        with self._lock:
+            self.status = "running" if indices else "done"
+            self.finished_at = None if indices else time.time()
+        RESULT_STORE.set_job_status(self.id, self.status)
+        start_job_heartbeat() # 다른 워커가 이 작업을 죽은 것으로 보고 이어받지 않도록
+        for index in finished:
+            self.set_group_result(index, self.results[index])
+        threading.Thread(target=self.prepare, args=(leaders,), name=f"prepare-{self.id[:8]}", daemon=True).start()
+        for index in leaders:
+            BATCH_EXECUTOR.submit(run_batch_item, self, index)
+
+    def try_requeue(self, index):
+        with self._lock:
+            if self._requeues[index] >= SERP_MAX_REQUEUE:
+                return False
+            self._requeues[index] += 1
+            self.requeued += 1
+            return True
+
+    def set_result(self, index, result, persist=True):
+        if persist:
+            RESULT_STORE.save_job_result(self.id, index, result)
+        with self._lock:
+            self.results[index] = result
+            self.completed.append(index)
+            self.done += 1
+            finished = self.done >= len(self.keywords)
+            if finished:
+                self.status = "done"
+                self.finished_at = time.time()
+            self._changed.notify_all()
+        if finished and persist:
+            RESULT_STORE.set_job_status(self.id, "done")
+
+    def set_group_result(self, leader, result):
+        """대표 줄의 결과를 같은 키워드의 모든 줄에 원래 입력한 키워드로 기록"""
+        for index in self.groups[keyword_key(self.keywords[leader])]:
+            if self.results[index] is None:
+                self.set_result(index, dict(result, keyword=self.keywords[index]))
+
+    def sync_from_store(self):
+        """저장소에 새로 저장된 결과를 읽어 들임 (복원할 때, 다른 워커가 돌리는 작업을 따라갈 때)"""
+        rows, self._synced_rowid = RESULT_STORE.job_results_since(self.id, self._synced_rowid)
+        for index, result in rows:
+            if self.results[index] is None:
+                self.set_result(index, result, persist=False)
+
+    def follow_store(self):
+        """다른 워커가 돌리는 작업: 새 결과를 읽고, 주인 워커가 사라졌으면 interrupted 로 바꿈"""
+        self.sync_from_store()
+        owner = RESULT_STORE.job_owner(self.id)
+        with self._lock:
+            if self.status == "running" and owner is not None and owner["status"] != "done" and not job_owner_alive(owner):
+                self.status = "interrupted"
+                self._changed.notify_all()
+
+    def iter_completed(self, start=0, heartbeat=15, poll=1):
+        """끝난 결과를 완료 순서대로 (position, index, result) 로 넘겨줌
+
+        heartbeat 초 동안 새 결과가 없으면 None 을 넘겨서 연결 유지용 줄을 보낼 수 있게 함.
+        다른 워커가 돌리는 작업이면 poll 초마다 저장소를 다시 읽는다.
+        """
+        position = start
+        idle_since = time.monotonic()
+        while True:
+            if self.remote:
+                self.follow_store()
+            with self._lock:
+                if position >= len(self.completed) and self.status in ("queued", "running"):
+                    self._changed.wait(timeout=poll if self.remote else heartbeat)
+                batch = self.completed[position:]
+                finished = self.status not in ("queued", "running") # done 또는 interrupted
+            if not batch:
+                if finished:
+                    return
+                if not self.remote or time.monotonic() - idle_since >= heartbeat:
+                    idle_since = time.monotonic()
+                    yield None
+                continue
+            for index in batch:
+                yield position, index, self.results[index]
+                position += 1
+            idle_since = time.monotonic()
+
+    def status_dict(self):
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "total": len(self.keywords),
+                "unique": len(self.groups),
+                "done": self.done,
+                "skipped": self.skipped,
+                "requeued": self.requeued,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+            }
+
+JOBS = {}
+JOBS_LOCK = threading.Lock()
+
+def run_batch_item(job, index):
+    keyword = job.query(index)
+    stored, stages = None, {}
+    try:
+        search_volume = job.volume_futures[volume_key(keyword)].result()
+        stored, stages = job.plans.get(index, (None, {}))
+        if stored is not None:
+            # 최근에 분석한 키워드는 저장된 결과를 그대로 씀 (웹훅도 이미 보냈으므로 다시 보내지 않음)
+            with job._lock:
+                job.skipped += 1
+            job.set_group_result(index, stored)
+            return
+        result = analyze_book(keyword, fetch_isbn=job.fetch_isbn, min_search_volume=job.min_search_volume,
+                              search_volume=search_volume, no_cache=job.no_cache, stages=stages)
+    except Exception as e:
+        result = {"keyword": keyword, "search_volume": 0, "seller_count": "-", "grade": "오류",
+                  "reason": f"분석 실패 ({str(e)[:20]})", "isbn": "-", "link": "#", "shipping_fee": "-", "store_rank": "-", "store_ranks": {}}
+    # 봇 차단으로 실패한 키워드는 브레이커가 닫힌 뒤 다시 줄 세움 (이미 받은 검색량/순위 단계는 stages 에 남아 재사용됨)
+    if is_bot_blocked(result) and job.try_requeue(index):
+        SERP_BREAKER.call_when_closed(lambda: BATCH_EXECUTOR.submit(run_batch_item, job, index))
+        return
+    send_webhook(result)
+    if should_store_result(result, stages):
+        RESULT_STORE.save_result(keyword, job.fetch_isbn, job.min_search_volume, result, stages)
+    job.set_group_result(index, result)
+
+def register_job(job):
+    with JOBS_LOCK:
+        JOBS[job.id] = job
+        # 오래된 완료 작업부터 메모리에서 정리 (저장소에는 남아 있음)
+        finished = sorted((j for j in JOBS.values() if j.status != "running"), key=lambda j: j.created_at)
+        while len(JOBS) > BATCH_JOB_RETENTION and finished:
+            JOBS.pop(finished.pop(0).id, None)
+
+def start_batch_job(keywords, fetch_isbn=False, min_search_volume=0, no_cache=False, refresh="missing", max_age=RESULT_MAX_AGE):
+    job = BatchJob(keywords, fetch_isbn=fetch_isbn, min_search_volume=min_search_volume, no_cache=no_cache,
+                   refresh=refresh, max_age=max_age)
+    RESULT_STORE.create_job(job)
+    register_job(job)
+    job.start(list(range(len(keywords))))
+    return job
+
+def load_batch_job(job_id):
+    """메모리에 없는 작업을 저장소에서 복원
+
+    다른 워커가 아직 돌리고 있으면(하트비트가 살아 있으면) 저장소를 따라 읽기만 하는 작업으로 돌려주고
+    (JOBS 에는 넣지 않음), 주인 워커가 사라졌으면 'interrupted' 로 등록한다.
+    """
+    saved = RESULT_STORE.load_job(job_id)
+    if saved is None:
+        return None
+    job = BatchJob(saved["keywords"], job_id=job_id, created_at=saved["created_at"], **saved["params"])
+    job.sync_from_store()
+    if job.status != "done":
+        if job_owner_alive(saved):
+            job.status = "running"
+            job.remote = True
+            return job
+        job.status = "interrupted"
+    register_job(job)
+    return job
+
+def resume_batch_job(job):
+    with job._lock:
+        if job.status != "interrupted":
+            return job
+        job.status = "queued"
+    if not RESULT_STORE.claim_job(job.id):
+        # 다른 워커가 먼저 이어받았으면 그쪽 진행 상황을 따라감
+        with JOBS_LOCK:
+            JOBS.pop(job.id, None)
+        return load_batch_job(job.id) or job
+    job.start(job.pending_indices())
+    return job
+
+_JOB_HEARTBEAT_LOCK = threading.Lock()
+_JOB_HEARTBEAT_THREAD = None
+
+def job_heartbeat_loop():
+    while True:
+        time.sleep(JOB_HEARTBEAT_INTERVAL)
+        with JOBS_LOCK:
+            running = [job.id for job in JOBS.values() if job.status in ("queued", "running")]
+        if running:
+            try:
+                RESULT_STORE.touch_jobs(running)
+            except sqlite3.Error:
+                pass # 다음 주기에 다시 시도
+
+def start_job_heartbeat():
+    global _JOB_HEARTBEAT_THREAD
+    with _JOB_HEARTBEAT_LOCK:
+        if _JOB_HEARTBEAT_THREAD is None or not _JOB_HEARTBEAT_THREAD.is_alive():
+            _JOB_HEARTBEAT_THREAD = threading.Thread(target=job_heartbeat_loop, name="job-heartbeat", daemon=True)
+            _JOB_HEARTBEAT_THREAD.start()
+
+# --- 결과 내보내기 (CSV / XLSX 를 저장소에서 한 줄씩 읽어 스트리밍) ---
+EXPORT_COLUMNS = OrderedDict([
+    ("keyword", "키워드"),
+    ("search_volume", "월간 총 검색량"),
+    ("seller_count", "판매처 수"),
+    ("grade", "분류 등급"),
+    ("reason", "분류 이유 (참고용)"),
+    ("isbn", "ISBN (B등급)"),
+    ("link", "링크"),
+    ("store_rank", "스토어 순위"),
+    ("serp_engine", "판정 방식"),
+    ("webhook_status", "스터디박스 전송"),
+])
+EXPORT_DEFAULT_COLUMNS = ["keyword", "search_volume", "seller_count", "grade", "reason", "isbn", "link"]
+EXPORT_CHUNK_ROWS = 500
+XML_ILLEGAL_CHARS = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+def iter_export_rows(job_id, grades=None):
+    """작업 결과를 입력 순서대로 EXPORT_CHUNK_ROWS 개씩 묶어서 넘겨줌 (웹훅 상태는 최신으로 갱신)"""
+    chunk = []
+    for result in RESULT_STORE.iter_job_results(job_id):
+        if grades and not any(result.get("grade", "").startswith(g) for g in grades):
+            continue
+        chunk.append(result)
+        if len(chunk) >= EXPORT_CHUNK_ROWS:
+            yield refresh_webhook_status(chunk)
+            chunk = []
+    if chunk:
+        yield refresh_webhook_status(chunk)
+
+def export_csv_values(result, columns):
+    values = []
+    for c in columns:
+        value = str(result.get(c, "-")).replace("\n", " ")
+        if c == "isbn" and value != "-":
+            value = f'="{value}"' # 엑셀이 ISBN 을 숫자(지수 표기)로 바꾸지 않도록
+        values.append(value)
+    return values
+
+def export_csv(job_id, columns, grades=None):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, quoting=csv.QUOTE_ALL, lineterminator="\n")
+    buffer.write("\ufeff") # 엑셀에서 한글이 깨지지 않도록 BOM
+    writer.writerow([EXPORT_COLUMNS[c] for c in columns])
+    for rows in iter_export_rows(job_id, grades):
+        for r in rows:
+            writer.writerow(export_csv_values(r, columns))
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+class ChunkSink(io.RawIOBase):
+    """ZipFile 이 쓴 바이트를 모아뒀다가 스트리밍 응답으로 넘기는 용도 (seek 불가)"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def xlsx_cell(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c t="n"><v>{value}</v></c>'
+    text = xml_escape(XML_ILLEGAL_CHARS.sub("", str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+XLSX_STATIC_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="분석결과" sheetId="1" r:id="rId1"/></sheets></workbook>'),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'),
+}
+
+def export_xlsx(job_id, columns, grades=None):
+    """시트를 inlineStr 로 한 줄씩 압축하면서 바로 내보내는 최소 XLSX 작성기 (메모리 사용량 일정)"""
+    sink = ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, body in XLSX_STATIC_PARTS.items():
+            zf.writestr(name, body)
+        with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                         '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>').encode("utf-8"))
+            sheet.write(("<row>" + "".join(xlsx_cell(EXPORT_COLUMNS[c]) for c in columns) + "</row>").encode("utf-8"))
+            for rows in iter_export_rows(job_id, grades):
+                sheet.write("".join(
+                    "<row>" + "".join(xlsx_cell(r.get(c, "-")) for c in columns) + "</row>" for r in rows
+                ).encode("utf-8"))
+                yield sink.pop()
+            sheet.write(b"</sheetData></worksheet>")
+    yield sink.pop()
+
 TEMPLATE = """
 <!DOCTYPE html>
 <html>
@@ -269,7 +2228,10 @@ TEMPLATE = """
 
     <div id="resultHeader" style="display: flex; justify-content: space-between; align-items: center; display: none; margin-top: 20px;">
         <h3 style="margin: 0;">분석 결과</h3>
-        <button onclick="downloadExcel()" class="btn btn-excel">📥 엑셀로 다운로드</button>
+        <div>
+            <button onclick="downloadExcel('csv')" class="btn btn-excel">📥 엑셀로 다운로드</button>
+            <button onclick="downloadExcel('xlsx')" class="btn btn-excel">📥 XLSX</button>
+        </div>
     </div>
     
     <div id="tableContainer" class="table-container">
@@ -307,27 +2269,62 @@ TEMPLATE = """
 
         sortOptionSelect.addEventListener('change', function() { applyCurrentSort(); });
 
+        let currentJobId = null;
+
+        function gradeScore(grade) {
+            return grade.includes('A') ? 1 : (grade.includes('C') ? 2 : 3);
+        }
+
+        function compareRows(a, b) {
+            if (sortOptionSelect.value === 'grade') {
+                const diff = parseInt(a.dataset.score) - parseInt(b.dataset.score);
+                if (diff !== 0) return diff;
+            }
+            return parseInt(a.dataset.index) - parseInt(b.dataset.index);
+        }
+
+        // 정렬 기준이 바뀌었을 때만 전체를 다시 정렬
         function applyCurrentSort() {
             const tbody = document.getElementById('resultBody');
-            const rows = Array.from(tbody.querySelectorAll('tr'));
-            const sortOption = document.getElementById('sortOption').value;
-
-            if (sortOption === 'grade') {
-                rows.sort((a, b) => {
-                    const textA = a.querySelector('td:nth-child(4) span').innerText;
-                    const textB = b.querySelector('td:nth-child(4) span').innerText;
-                    let scoreA = textA.includes('A') ? 1 : (textA.includes('C') ? 2 : 3);
-                    let scoreB = textB.includes('A') ? 1 : (textB.includes('C') ? 2 : 3);
-                    if (scoreA === scoreB) return parseInt(a.getAttribute('data-index')) - parseInt(b.getAttribute('data-index'));
-                    return scoreA - scoreB;
-                });
-                tbody.innerHTML = '';
-                rows.forEach(row => tbody.appendChild(row));
-                document.getElementById('tableContainer').scrollTop = 0;
-            } else {
-                rows.sort((a, b) => parseInt(a.getAttribute('data-index')) - parseInt(b.getAttribute('data-index')));
-                tbody.innerHTML = '';
-                rows.forEach(row => tbody.appendChild(row));
+            const rows = Array.from(tbody.children);
+            rows.sort(compareRows);
+            const fragment = document.createDocumentFragment();
+            rows.forEach(row => fragment.appendChild(row));
+            tbody.appendChild(fragment);
+            if (sortOptionSelect.value === 'grade') document.getElementById('tableContainer').scrollTop = 0;
+        }
+
+        // 새 행은 이진 탐색으로 정렬된 위치에 바로 끼워 넣음
+        function insertSorted(tr) {
+            const tbody = document.getElementById('resultBody');
+            const rows = tbody.children;
+            let lo = 0, hi = rows.length;
+            while (lo < hi) {
+                const mid = (lo + hi) >> 1;
+                if (compareRows(rows[mid], tr) <= 0) lo = mid + 1;
+                else hi = mid;
+            }
+            tbody.insertBefore(tr, rows[lo] || null);
+        }
+
+        function errorRow(kw, index, reason) {
+            return { keyword: kw, search_volume: 0, seller_count: "-", grade: "오류", reason: reason, isbn: "-", link: "#", webhook_status: "통신 실패", original_index: index };
+        }
+
+        async function readStream(response, onMessage) {
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                let newline;
+                while ((newline = buffer.indexOf('\\n')) >= 0) {
+                    const line = buffer.slice(0, newline).trim();
+                    buffer = buffer.slice(newline + 1);
+                    if (line) onMessage(JSON.parse(line));
+                }
             }
         }
 
@@ -349,39 +2346,102 @@ TEMPLATE = """
             const tbody = document.getElementById('resultBody');
             tbody.innerHTML = ''; 
             document.getElementById('progressBar').style.width = '0%';
+            document.getElementById('progressText').innerText = `[0 / ${total}] 분석 요청 중...`;
 
-            for (let i = 0; i < total; i++) {
-                const kw = keywords[i];
-                document.getElementById('progressText').innerText = `[${i + 1} / ${total}] "${kw}" 분석 중...`;
-                
-                let rowData = null;
+            let jobId = null;
+            let received = 0;
+            let finished = false;
+            let interrupted = false;
+            const onMessage = (msg) => {
+                if (msg.type === 'job') {
+                    jobId = msg.job_id;
+                    currentJobId = jobId;
+                } else if (msg.type === 'result') {
+                    if (msg.position < received) return; // 재연결 시 중복 방지
+                    received = msg.position + 1;
+                    const rowData = msg.result;
+                    rowData.original_index = msg.index;
+                    appendRow(rowData);
+                    document.getElementById('progressText').innerText = `[${received} / ${total}] "${rowData.keyword}" 완료`;
+                    document.getElementById('progressBar').style.width = Math.round((received / total) * 100) + '%';
+                } else if (msg.type === 'done') {
+                    finished = true;
+                } else if (msg.type === 'interrupted') {
+                    finished = true;
+                    interrupted = true;
+                }
+            };
+
+            let retries = 0;
+            while (!finished) {
                 try {
-                    const response = await fetch('/api/analyze', {
-                        method: 'POST',
-                        headers: { 'Content-Type': 'application/json' },
-                        body: JSON.stringify({ keyword: kw, fetch_isbn: fetchIsbn, min_search_volume: minVol })
-                    });
-                    rowData = await response.json();
+                    const response = jobId === null
+                        ? await fetch('/api/batch/stream', {
+                            method: 'POST',
+                            headers: { 'Content-Type': 'application/json' },
+                            body: JSON.stringify({ keywords: keywords, fetch_isbn: fetchIsbn, min_search_volume: minVol })
+                        })
+                        : await fetch(`/api/batch/${jobId}/stream?from=${received}&resume=1`);
+                    if (!response.ok) throw new Error(response.status);
+                    await readStream(response, onMessage);
+                    retries = 0;
                 } catch (error) {
-                    rowData = { keyword: kw, search_volume: 0, seller_count: "-", grade: "오류", reason: "네트워크 실패", isbn: "-", link: "#", webhook_status: "통신 실패" };
+                    retries += 1;
                 }
-
-                rowData.original_index = i;
-                appendRow(rowData);
-
-                const percent = Math.round(((i + 1) / total) * 100);
-                document.getElementById('progressBar').style.width = percent + '%';
+                // 작업 생성 전에 실패했거나 재연결이 계속 실패하면 남은 키워드는 오류로 표시
+                if (interrupted || (!finished && (jobId === null || retries > 5))) {
+                    const shown = new Set(Array.from(tbody.children).map(tr => parseInt(tr.dataset.index)));
+                    const reason = interrupted ? "작업 중단 (재개 필요)" : "네트워크 실패";
+                    keywords.forEach((kw, i) => { if (!shown.has(i)) appendRow(errorRow(kw, i, reason)); });
+                    break;
+                }
+                if (!finished) await new Promise(resolve => setTimeout(resolve, 1000 * retries));
             }
 
-            document.getElementById('progressText').innerText = `✅ 분석 완료! (총 ${total}건)`;
+            document.getElementById('progressText').innerText = interrupted
+                ? `⚠️ 작업이 중단되었습니다 (${received} / ${total}건 완료)`
+                : `✅ 분석 완료! (총 ${total}건)`;
+            document.getElementById('progressBar').style.width = '100%';
             btn.disabled = false;
             btn.innerText = "일괄 분석 시작";
+            pollWebhookStatus();
+        }
+
+        function webhookColor(msg) {
+            if (msg.includes('성공')) return 'green';
+            if (msg === '대기' || msg.includes('전송 중') || msg.includes('재시도')) return '#888';
+            return 'red';
+        }
+
+        // 웹훅은 서버에서 따로 전송되므로 끝날 때까지 상태를 주기적으로 갱신
+        async function pollWebhookStatus() {
+            for (let attempt = 0; attempt < 60; attempt++) {
+                const pending = Array.from(document.querySelectorAll('#resultBody tr[data-webhook-id]'));
+                if (pending.length === 0) return;
+                for (let i = 0; i < pending.length; i += 500) {
+                    const chunk = pending.slice(i, i + 500);
+                    let statuses = {};
+                    try {
+                        const response = await fetch('/api/webhook/status?ids=' + chunk.map(tr => tr.dataset.webhookId).join(','));
+                        statuses = await response.json();
+                    } catch (error) { continue; }
+                    chunk.forEach(tr => {
+                        const msg = statuses[tr.dataset.webhookId];
+                        if (!msg) return;
+                        const span = tr.querySelector('.wh-status');
+                        span.innerText = `[스터디박스 전송: ${msg}]`;
+                        span.style.color = webhookColor(msg);
+                        if (msg.includes('성공') || msg.includes('전송 실패')) tr.removeAttribute('data-webhook-id');
+                    });
+                }
+                await new Promise(resolve => setTimeout(resolve, 3000));
+            }
         }
 
         function appendRow(r) {
-            const tbody = document.getElementById('resultBody');
             const tr = document.createElement('tr');
             tr.setAttribute('data-index', r.original_index);
+            tr.setAttribute('data-score', gradeScore(r.grade));
             
             const isGradeA = r.grade.includes('A');
             const isGradeB = r.grade.includes('B');
@@ -402,8 +2462,8 @@ TEMPLATE = """
 
             if (isGradeA || isGradeB || isGradeC) {
                 let whMsg = r.webhook_status || '응답 없음';
-                let whColor = whMsg.includes('성공') ? 'green' : 'red';
-                reasonHtml += `<br><span style="color:${whColor}; font-size:0.85em; font-weight:bold;">[스터디박스 전송: ${whMsg}]</span>`;
+                reasonHtml += `<br><span class="wh-status" style="color:${webhookColor(whMsg)}; font-size:0.85em; font-weight:bold;">[스터디박스 전송: ${whMsg}]</span>`;
+                if (r.webhook_id) tr.setAttribute('data-webhook-id', r.webhook_id);
             }
 
             tr.innerHTML = `
@@ -415,11 +2475,19 @@ TEMPLATE = """
                 <td style="font-family: monospace; color: #555;">${r.isbn || '-'}</td>
                 <td><a href="${r.link}" target="_blank">확인하기</a></td>
             `;
-            tbody.appendChild(tr);
-            applyCurrentSort();
+            insertSorted(tr);
+        }
+
+        // 서버에 저장된 결과를 바로 내려받음 (표를 훑지 않으므로 행이 많아도 멈추지 않음)
+        function downloadExcel(format) {
+            if (currentJobId) {
+                window.location.href = `/api/batch/${currentJobId}/export?format=${format}`;
+                return;
+            }
+            downloadTableCsv();
         }
 
-        function downloadExcel() {
+        function downloadTableCsv() {
             let csv = '\uFEFF'; 
             let rows = document.querySelectorAll("#resultTable tr");
             for (let i = 0; i < rows.length; i++) {
@@ -460,27 +2528,154 @@ def api_analyze():
     keyword = data.get("keyword", "")
     fetch_isbn = data.get("fetch_isbn", False)
     min_search_volume = int(data.get("min_search_volume", 0))
+    no_cache = bool(data.get("no_cache", False))
+    timings = {} if data.get("timings") else None # 요청한 경우에만 단계별 소요 시간(ms)을 응답에 포함
     
-    result = analyze_book(keyword, fetch_isbn=fetch_isbn, min_search_volume=min_search_volume)
-    result['webhook_status'] = '대기'
-    
-    grade = result.get("grade", "")
-    
-    if "A" in grade or "B" in grade or "C" in grade:
-        webhook_url = os.environ.get("STUDYBOX_WEBHOOK_URL", "").strip()
-        if not webhook_url:
-            result['webhook_status'] = '환경변수 누락 (전송불가)'
-        else:
-            try:
-                res = requests.post(webhook_url, json=result, timeout=5)
-                if res.status_code == 200:
-                    result['webhook_status'] = '성공!'
-                else:
-                    result['webhook_status'] = f'서버 거절 ({res.status_code})'
-            except:
-                result['webhook_status'] = '통신 에러'
+    stages = {}
+    result = analyze_book(normalize_keyword(keyword), fetch_isbn=fetch_isbn, min_search_volume=min_search_volume,
+                          no_cache=no_cache, stages=stages, timings=timings)
+    result["keyword"] = keyword
+    send_webhook(result)
+    if should_store_result(result, stages):
+        RESULT_STORE.save_result(keyword, fetch_isbn, min_search_volume, result, stages)
 
+    if timings is not None:
+        return jsonify(dict(result, timings=timings))
     return jsonify(result)
 
+def batch_request_params(data):
+    return {
+        "fetch_isbn": bool(data.get("fetch_isbn", False)),
+        "min_search_volume": int(data.get("min_search_volume", 0)),
+        "no_cache": bool(data.get("no_cache", False)),
+        "refresh": data.get("refresh", "missing"),
+        "max_age": int(data.get("max_age", RESULT_MAX_AGE)),
+    }
+
+@app.route("/api/batch", methods=["POST"])
+def api_batch():
+    data = request.get_json() or {}
+    keywords = [str(k).strip() for k in data.get("keywords", []) if str(k).strip()]
+    if not keywords:
+        return jsonify({"error": "keywords 가 비어 있습니다"}), 400
+
+    job = start_batch_job(keywords, **batch_request_params(data))
+    return jsonify(job.status_dict()), 202
+
+def get_job_or_404(job_id):
+    with JOBS_LOCK:
+        job = JOBS.get(job_id)
+    if job is None:
+        job = load_batch_job(job_id)
+    if job is None:
+        abort(404)
+    return job
+
+@app.route("/api/batch/<job_id>/export", methods=["GET"])
+def api_batch_export(job_id):
+    # 결과는 저장소에서 한 줄씩 읽으므로 작업 전체를 메모리로 복원하지 않고 있는지만 확인
+    if not RESULT_STORE.job_exists(job_id):
+        abort(404)
+    export_format = request.args.get("format", "csv").lower()
+    columns = [c for c in request.args.get("columns", "").split(",") if c in EXPORT_COLUMNS] or EXPORT_DEFAULT_COLUMNS
+    grades = [g.strip() for g in request.args.get("grades", "").split(",") if g.strip()]
+
+    filename = urllib.parse.quote(f"도서_분석결과_{job_id[:8]}")
+    if export_format == "xlsx":
+        response = Response(export_xlsx(job_id, columns, grades), mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+        response.headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{filename}.xlsx"
+    else:
+        response = Response(export_csv(job_id, columns, grades), mimetype="text/csv; charset=utf-8")
+        response.headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{filename}.csv"
+    return response
+
+@app.route("/api/batch/<job_id>/resume", methods=["POST"])
+def api_batch_resume(job_id):
+    # 중단된 작업은 남은 키워드만 다시 돌림
+    job = resume_batch_job(get_job_or_404(job_id))
+    return jsonify(job.status_dict()), 202
+
+def stream_job(job, start=0):
+    """배치 결과를 NDJSON 한 줄씩 완료 순서대로 흘려보냄"""
+    def generate():
+        yield json.dumps({"type": "job", **job.status_dict()}, ensure_ascii=False) + "\n"
+        for item in job.iter_completed(start=start):
+            if item is None:
+                yield json.dumps({"type": "ping"}) + "\n"
+                continue
+            position, index, result = item
+            yield json.dumps({"type": "result", "position": position, "index": index, "result": result}, ensure_ascii=False) + "\n"
+        # 재시작으로 중단된 작업(interrupted)이면 그 상태로 끝을 알려서 페이지가 무한히 기다리지 않게 함
+        status = job.status_dict()
+        yield json.dumps({"type": "done" if status["status"] == "done" else "interrupted", **status}, ensure_ascii=False) + "\n"
+
+    response = Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no" # 프록시 버퍼링 끄기
+    return response
+
+@app.route("/api/batch/stream", methods=["POST"])
+def api_batch_stream():
+    data = request.get_json() or {}
+    keywords = [str(k).strip() for k in data.get("keywords", []) if str(k).strip()]
+    if not keywords:
+        return jsonify({"error": "keywords 가 비어 있습니다"}), 400
+
+    job = start_batch_job(keywords, **batch_request_params(data))
+    return stream_job(job)
+
+@app.route("/api/batch/<job_id>/stream", methods=["GET"])
+def api_batch_stream_resume(job_id):
+    # 연결이 끊겼을 때 받은 개수(from)부터 이어받기. resume=1 이면 주인 워커가 사라져 중단된 작업을 이어서 실행
+    job = get_job_or_404(job_id)
+    if job.status == "interrupted" and request.args.get("resume") == "1":
+        job = resume_batch_job(job)
+    return stream_job(job, start=max(0, int(request.args.get("from", 0))))
+
+@app.route("/api/batch/<job_id>", methods=["GET"])
+def api_batch_status(job_id):
+    return jsonify(get_job_or_404(job_id).status_dict())
+
+@app.route("/api/batch/<job_id>/result", methods=["GET"])
+def api_batch_result(job_id):
+    job = get_job_or_404(job_id)
+    body = job.status_dict()
+    body["results"] = refresh_webhook_status([dict(r) if r else None for r in job.results])
+    return jsonify(body)
+
+@app.route("/api/webhook/status", methods=["GET"])
+def api_webhook_status():
+    ids = [i for i in request.args.get("ids", "").split(",") if i.strip().isdigit()]
+    return jsonify({str(k): v for k, v in WEBHOOK_OUTBOX.status(ids).items()})
+
+@app.route("/api/stats", methods=["GET"])
+def api_stats():
+    return jsonify({
+        "cache": CACHE.stats(),
+        "serp": serp_engine_stats(),
+        "rate_limits": {name: limiter.stats() for name, limiter in RATE_LIMITERS.items()},
+        "serp_breaker": SERP_BREAKER.stats(),
+        "isbn": ISBN_RESOLVER.stats(),
+    })
+
+def current_gauges():
+    executors = {"batch": BATCH_EXECUTOR, "stage": STAGE_EXECUTOR, "rank": RANK_EXECUTOR, "isbn": ISBN_EXECUTOR}
+    with JOBS_LOCK:
+        running = [job for job in JOBS.values() if job.status == "running"]
+    return [
+        ("bookall_browser_pool_size", [({}, BROWSER_POOL.size)]),
+        ("bookall_browser_pool_in_use", [({}, BROWSER_POOL.in_use)]),
+        ("bookall_browser_pool_waiting", [({}, BROWSER_POOL.waiting)]),
+        ("bookall_executor_queue_depth", [({"executor": name}, executor._work_queue.qsize())
+                                          for name, executor in executors.items()]),
+        ("bookall_batch_jobs_running", [({}, len(running))]),
+        ("bookall_batch_keywords_pending", [({}, sum(len(job.keywords) - job.done for job in running))]),
+        ("bookall_serp_breaker_open", [({}, 0 if SERP_BREAKER.state == "closed" else 1)]),
+    ]
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(METRICS.render(current_gauges()), mimetype="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
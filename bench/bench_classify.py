@@ -0,0 +1,81 @@
+"""검색결과(SERP) 등급 판정 마이크로벤치마크
+
+bench/fixtures/serp 에 저장된 HTML 로 classify_serp 를 돌려서
+1) expected.json 의 A/B/C 등급과 같은지 확인하고
+2) 파서별 페이지당 판정 시간을 출력한다.
+
+    python bench/bench_classify.py [--repeat 50]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "serp")
+
+def load_fixtures():
+    with open(os.path.join(FIXTURE_DIR, "expected.json"), encoding="utf-8") as f:
+        expected = json.load(f)
+    fixtures = []
+    for name, case in expected.items():
+        with open(os.path.join(FIXTURE_DIR, f"{name}.html"), encoding="utf-8") as f:
+            fixtures.append((name, f.read(), case))
+    return fixtures
+
+def available_parsers():
+    parsers = ["html.parser"]
+    if app.default_serp_parser() == "lxml":
+        parsers.append("lxml")
+    return parsers
+
+def check_grades(fixtures, parser):
+    failures = []
+    for name, html, case in fixtures:
+        grade, _, seller_count = app.classify_serp(html, case["search_volume"], case["min_search_volume"], parser=parser)
+        if grade != case["grade"] or seller_count != case["seller_count"]:
+            failures.append(f"{name}: {grade} / {seller_count} (기대값 {case['grade']} / {case['seller_count']})")
+    return failures
+
+def time_per_page(fn, fixtures, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for _, html, case in fixtures:
+            fn(html, case)
+    return (time.perf_counter() - start) * 1000 / (repeat * len(fixtures))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    fixtures = load_fixtures()
+    ok = True
+    for name in available_parsers():
+        failures = check_grades(fixtures, name)
+        if failures:
+            ok = False
+            print(f"[{name}] 등급 불일치 {len(failures)}건")
+            for line in failures:
+                print("  " + line)
+        else:
+            print(f"[{name}] 등급 일치 {len(fixtures)}/{len(fixtures)}")
+
+    # 이전 방식(문서 전체를 html.parser 로 파싱)과 비교용 기준값
+    baseline = time_per_page(lambda html, case: BeautifulSoup(html, "html.parser"), fixtures, args.repeat)
+    print(f"{'full-document html.parser':<28} {baseline:8.2f} ms/page")
+    for name in available_parsers():
+        elapsed = time_per_page(
+            lambda html, case: app.classify_serp(html, case["search_volume"], case["min_search_volume"], parser=name),
+            fixtures, args.repeat)
+        print(f"{'classify_serp ' + name:<28} {elapsed:8.2f} ms/page")
+
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""목 서버를 상대로 analyze_book / POST /api/analyze 전체 처리량 벤치마크
+
+bench/mock_naver.py 를 띄우고, 배치 크기와 실행 방식마다 별도 프로세스에서 app 을 불러
+키워드를 끝까지 분석한 뒤 초당 키워드 수, 단계별 p50/p95 지연, 최대 RSS 를 출력한다.
+실제 네이버 API 쿼터는 쓰지 않는다.
+
+    python bench/bench_pipeline.py [--sizes 10,100,1000,10000] [--modes serial,concurrent,api-serial,api-concurrent]
+                                   [--workers 8] [--latency-ms 30] [--serp-latency-ms 150]
+                                   [--error-rate 0.01] [--captcha-rate 0.02] [--json]
+
+실행 방식
+  serial          analyze_book 을 하나씩 순서대로
+  concurrent      analyze_book 을 --workers 개 스레드로 동시에
+  api-serial      Flask test client 로 POST /api/analyze 를 하나씩
+  api-concurrent  POST /api/analyze 를 --workers 개 스레드로 동시에
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+MODES = ("serial", "concurrent", "api-serial", "api-concurrent")
+STAGES = ("volume", "serp", "isbn", "rank", "total")
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+def bench_keywords(size):
+    return [f"벤치 키워드 {i}" for i in range(size)]
+
+def run_child(args):
+    """환경변수가 목 서버를 가리키는 상태에서 한 가지 (방식, 크기) 조합을 실행"""
+    sys.path.insert(0, os.path.dirname(BENCH_DIR))
+    import app
+
+    timings = {stage: [] for stage in STAGES}
+    keywords = bench_keywords(args.size)
+    grades = Counter()
+    local = threading.local()
+
+    def analyze(keyword):
+        # 단계별 시간은 app 이 직접 잰 값(analyze_book 의 timings)을 씀
+        if args.mode.startswith("api"):
+            client = getattr(local, "client", None)
+            if client is None:
+                client = local.client = app.app.test_client()
+            result = client.post("/api/analyze", json={"keyword": keyword, "fetch_isbn": args.fetch_isbn,
+                                                       "min_search_volume": args.min_search_volume,
+                                                       "no_cache": True, "timings": True}).get_json()
+            keyword_timings = result["timings"]
+        else:
+            keyword_timings = {}
+            result = app.analyze_book(keyword, fetch_isbn=args.fetch_isbn, min_search_volume=args.min_search_volume,
+                                      no_cache=True, timings=keyword_timings)
+        for stage, ms in keyword_timings.items():
+            if stage in timings:
+                timings[stage].append(ms)
+        return result["grade"]
+
+    start = time.perf_counter()
+    if args.mode.endswith("serial"):
+        for keyword in keywords:
+            grades[analyze(keyword)] += 1
+    else:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            for grade in executor.map(analyze, keywords):
+                grades[grade] += 1
+    elapsed = time.perf_counter() - start
+
+    print(json.dumps({
+        "mode": args.mode,
+        "size": args.size,
+        "elapsed": elapsed,
+        "keywords_per_sec": args.size / elapsed if elapsed else 0.0,
+        "stages": {stage: {"count": len(values), "p50_ms": percentile(values, 50), "p95_ms": percentile(values, 95)}
+                   for stage, values in timings.items()},
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, # 리눅스는 KB 단위
+        "grades": dict(grades),
+    }, ensure_ascii=False))
+    return 0
+
+def child_env(args, base_url, workdir):
+    env = dict(os.environ)
+    env.update({
+        "NAVER_AD_API_BASE": base_url,
+        "NAVER_OPENAPI_BASE": base_url,
+        "NAVER_SEARCH_BASE": base_url,
+        "SERP_ENGINE": "http",
+        "ACCESS_KEY": "bench", "SECRET_KEY": "bench", "CUSTOMER_ID": "0",
+        "NAVER_CLIENT_ID": "bench", "NAVER_CLIENT_SECRET": "bench",
+        "STUDYBOX_WEBHOOK_URL": "",
+        "CACHE_BACKEND": "memory",
+        "RATE_LIMIT_BACKEND": "memory",
+        "RESULT_STORE_PATH": os.path.join(workdir, "results.sqlite3"),
+        "ISBN_INDEX_PATH": os.path.join(workdir, "isbn.sqlite3"),
+        "WEBHOOK_OUTBOX_PATH": os.path.join(workdir, "outbox.sqlite3"),
+        "BATCH_WORKERS": str(args.workers),
+    })
+    if not args.respect_rate_limits:
+        # 목 서버 자체의 처리량을 재는 게 목적이므로 속도 제한과 쿼터는 기본으로 풀어둠
+        for name in ("AD_API_RATE_PER_SEC", "BOOK_RATE_PER_SEC", "SHOP_RATE_PER_SEC", "SEARCH_RATE_PER_SEC"):
+            env[name] = "100000"
+        for name in ("AD_API_DAILY_QUOTA", "BOOK_DAILY_QUOTA", "SHOP_DAILY_QUOTA"):
+            env[name] = "0"
+    return env
+
+def start_mock(args):
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "mock_naver.py"), "--port", "0",
+         "--latency-ms", str(args.latency_ms), "--serp-latency-ms", str(args.serp_latency_ms),
+         "--error-rate", str(args.error_rate), "--captcha-rate", str(args.captcha_rate), "--seed", "1"],
+        stdout=subprocess.PIPE, text=True)
+    port = int(proc.stdout.readline())
+    return proc, f"http://127.0.0.1:{port}"
+
+def mock_request(base_url, path, method="GET"):
+    with urllib.request.urlopen(urllib.request.Request(base_url + path, method=method, data=b"" if method == "POST" else None)) as res:
+        return json.load(res)
+
+def print_row(row, calls):
+    stages = row["stages"]
+    per_keyword = sum(v for k, v in calls.items() if not k.endswith("_error")) / row["size"]
+    print(f"{row['mode']:<15} {row['size']:>6} {row['keywords_per_sec']:>9.1f} kw/s {row['elapsed']:>8.1f}s "
+          f"rss {row['peak_rss_mb']:>6.0f}MB  upstream {per_keyword:4.1f}/kw")
+    for stage, value in stages.items():
+        if value["count"]:
+            print(f"    {stage:<7} n={value['count']:<6} p50 {value['p50_ms']:>8.1f}ms  p95 {value['p95_ms']:>8.1f}ms")
+    print(f"    grades {row['grades']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10,100,1000,10000")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--serial-max", type=int, default=1000, help="이보다 큰 배치는 순차 방식을 건너뜀")
+    parser.add_argument("--latency-ms", type=float, default=30)
+    parser.add_argument("--serp-latency-ms", type=float, default=150)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--captcha-rate", type=float, default=0.0)
+    parser.add_argument("--fetch-isbn", action="store_true")
+    parser.add_argument("--min-search-volume", type=int, default=0)
+    parser.add_argument("--respect-rate-limits", action="store_true", help="app 의 속도 제한 설정을 그대로 적용")
+    parser.add_argument("--json", action="store_true", help="결과를 JSON 줄로 출력")
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "SIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        args.mode, args.size = args.child[0], int(args.child[1])
+        return run_child(args)
+
+    modes = [mode for mode in args.modes.split(",") if mode]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f"알 수 없는 실행 방식: {', '.join(sorted(unknown))}")
+
+    proc, base_url = start_mock(args)
+    try:
+        for size in (int(s) for s in args.sizes.split(",") if s):
+            for mode in modes:
+                if mode.endswith("serial") and size > args.serial_max:
+                    if not args.json:
+                        print(f"{mode:<15} {size:>6} (건너뜀: --serial-max {args.serial_max})")
+                    continue
+                mock_request(base_url, "/__reset", method="POST")
+                with tempfile.TemporaryDirectory() as workdir:
+                    command = [sys.executable, os.path.abspath(__file__), "--child", mode, str(size),
+                               "--workers", str(args.workers), "--min-search-volume", str(args.min_search_volume)]
+                    if args.fetch_isbn:
+                        command.append("--fetch-isbn")
+                    out = subprocess.run(command, env=child_env(args, base_url, workdir), cwd=workdir,
+                                         stdout=subprocess.PIPE, text=True, check=True).stdout
+                row = json.loads(out.strip().splitlines()[-1])
+                calls = mock_request(base_url, "/__stats")
+                if args.json:
+                    print(json.dumps(dict(row, upstream_calls=calls), ensure_ascii=False))
+                else:
+                    print_row(row, calls)
+    finally:
+        proc.terminate()
+        proc.wait()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""벤치마크용 네이버 목(mock) 서버
+
+bench/fixtures 에 저장해 둔 응답(keywordstool, book.json, shop.json, 검색결과 HTML)을
+키워드별로 조금씩 바꿔서 돌려준다. 같은 키워드는 항상 같은 응답을 받는다.
+지연 시간과 5xx 오류 / 캡차 페이지 비율을 옵션으로 줄 수 있다.
+
+    python bench/mock_naver.py --port 8099 --latency-ms 30 --serp-latency-ms 150 --captcha-rate 0.02
+
+app.py 는 아래 환경변수로 이 서버를 보게 된다.
+
+    NAVER_AD_API_BASE=http://127.0.0.1:8099
+    NAVER_OPENAPI_BASE=http://127.0.0.1:8099
+    NAVER_SEARCH_BASE=http://127.0.0.1:8099
+    SERP_ENGINE=http
+
+GET /__stats 는 경로별 요청 수, POST /__reset 은 카운터 초기화.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+def load_fixtures():
+    api = {}
+    for name in ("keywordstool", "book", "shop"):
+        with open(os.path.join(FIXTURE_DIR, "api", f"{name}.json"), encoding="utf-8") as f:
+            api[name] = json.load(f)
+    serp = {}
+    serp_dir = os.path.join(FIXTURE_DIR, "serp")
+    for filename in sorted(os.listdir(serp_dir)):
+        if filename.endswith(".html"):
+            with open(os.path.join(serp_dir, filename), encoding="utf-8") as f:
+                serp[filename[:-5]] = f.read().encode("utf-8")
+    return api, serp
+
+def stable_hash(text):
+    return zlib.crc32(text.encode("utf-8"))
+
+def isbn13_for(query):
+    first12 = "979" + str(stable_hash(query) % 10 ** 9).zfill(9)
+    total = sum(int(d) * (1 if i % 2 == 0 else 3) for i, d in enumerate(first12))
+    return first12 + str((10 - total % 10) % 10)
+
+class MockNaver:
+    def __init__(self, latency_ms=30, serp_latency_ms=150, jitter=0.3, error_rate=0.0, captcha_rate=0.0,
+                 store_mall="스터디박스", seed=None):
+        self.api, self.serp = load_fixtures()
+        self.serp_pages = [page for name, page in self.serp.items() if name != "blocked_captcha"]
+        self.latency = latency_ms / 1000
+        self.serp_latency = serp_latency_ms / 1000
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.captcha_rate = captcha_rate
+        self.store_mall = store_mall
+        self.random = random.Random(seed)
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def delay(self, base):
+        if base > 0:
+            time.sleep(base * self.random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def keywordstool(self, params):
+        related = self.api["keywordstool"]["keywordList"]
+        items = []
+        for hint in params.get("hintKeywords", [""])[0].split(","):
+            h = stable_hash(hint)
+            item = dict(related[0], relKeyword=hint, monthlyPcQcCnt=h % 3000, monthlyMobileQcCnt=(h >> 8) % 12000)
+            if h % 17 == 0:
+                item["monthlyPcQcCnt"] = "< 10"
+            items.append(item)
+        # 실제 응답처럼 연관 키워드가 뒤에 딸려 옴
+        items.extend(related[1:])
+        return {"keywordList": items}
+
+    def book(self, params):
+        query = params.get("query", [""])[0]
+        payload = dict(self.api["book"])
+        if stable_hash(query) % 5 == 0: # 일부 키워드는 검색 결과 없음
+            return dict(payload, total=0, display=0, items=[])
+        template = payload["items"][0]
+        first = dict(template, title=query, isbn=isbn13_for(query))
+        return dict(payload, items=[first] + payload["items"][1:])
+
+    def shop(self, params):
+        query = params.get("query", [""])[0]
+        start = int(params.get("start", ["1"])[0])
+        display = int(params.get("display", ["100"])[0])
+        templates = self.api["shop"]["items"]
+        store_rank = stable_hash(query) % 800 + 1 # 500위 밖인 키워드도 섞임
+        items = []
+        for rank in range(start, start + display):
+            item = dict(templates[rank % len(templates)], productId=str(rank))
+            if rank == store_rank:
+                item["mallName"] = self.store_mall
+            items.append(item)
+        return dict(self.api["shop"], start=start, display=display, items=items)
+
+    def serp_page(self, params):
+        query = params.get("query", [""])[0]
+        if self.captcha_rate and self.random.random() < self.captcha_rate:
+            return self.serp["blocked_captcha"]
+        return self.serp_pages[stable_hash(query) % len(self.serp_pages)]
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+
+def make_handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # keep-alive 로 앱 쪽 커넥션 풀을 그대로 쓰게 함
+        # 헤더와 본문을 한 번에 보내서 Nagle + delayed ACK 로 생기는 40ms 지연을 없앰
+        wbufsize = 64 * 1024
+        disable_nagle_algorithm = True
+
+        def send_body(self, status, body, content_type="application/json; charset=utf-8"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_json(self, payload, status=200):
+            self.send_body(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+
+        def do_POST(self):
+            if self.path == "/__reset":
+                mock.reset()
+                return self.send_json({"ok": True})
+            self.send_json({"errorMessage": "not found"}, status=404)
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            params = urllib.parse.parse_qs(url.query)
+            if url.path == "/__stats":
+                return self.send_json(mock.stats())
+
+            routes = {
+                "/keywordstool": ("keywordstool", mock.latency),
+                "/v1/search/book.json": ("book", mock.latency),
+                "/v1/search/shop.json": ("shop", mock.latency),
+                "/search.naver": ("serp", mock.serp_latency),
+            }
+            if url.path not in routes:
+                return self.send_json({"errorMessage": "not found"}, status=404)
+            name, latency = routes[url.path]
+            with mock.lock:
+                mock.counts[name] += 1
+            mock.delay(latency)
+
+            if mock.error_rate and mock.random.random() < mock.error_rate:
+                with mock.lock:
+                    mock.counts[name + "_error"] += 1
+                return self.send_json({"errorMessage": "injected error"}, status=500)
+            if name == "serp":
+                return self.send_body(200, mock.serp_page(params), "text/html; charset=utf-8")
+            self.send_json(getattr(mock, name)(params))
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099, help="0 이면 빈 포트를 골라서 첫 줄에 출력")
+    parser.add_argument("--latency-ms", type=float, default=30, help="API 응답 지연 (keywordstool/book/shop)")
+    parser.add_argument("--serp-latency-ms", type=float, default=150, help="검색결과 페이지 응답 지연")
+    parser.add_argument("--jitter", type=float, default=0.3, help="지연 시간 흔들림 비율 (0.3 이면 ±30%%)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="500 응답 비율")
+    parser.add_argument("--captcha-rate", type=float, default=0.0, help="검색결과 대신 캡차 페이지를 줄 비율")
+    parser.add_argument("--store-mall", default="스터디박스")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    mock = MockNaver(args.latency_ms, args.serp_latency_ms, args.jitter, args.error_rate, args.captcha_rate,
+                     args.store_mall, args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(mock))
+    server.daemon_threads = True
+    print(server.server_address[1], flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,317 @@
+"""웹 화면 없이 키워드 목록을 분석하는 명령줄 배치 실행기
+
+키워드를 파일(또는 표준입력)에서 한 줄씩 읽어 analyze_book 으로 분석하고,
+입력 순서대로 NDJSON 이나 CSV 로 바로바로 기록한다. 동시에 들고 있는 키워드 수가
+--workers 에 비례해서 고정되므로 입력이 아무리 길어도 메모리 사용량은 일정하다.
+검색량은 웹 배치처럼 들고 있는 키워드를 묶어서 한꺼번에 조회한다.
+최근 --dedup-window 개 안에서 같은 키워드로 보이는 줄(공백/전각/대소문자/접미사 차이)은
+한 번만 분석하고 결과를 각 줄에 그대로 쓴다.
+
+    python cli.py keywords.txt -o results.ndjson
+    python cli.py keywords.txt -o results.csv --format csv --workers 8 --fetch-isbn
+    cat keywords.txt | python cli.py - -o results.ndjson
+    python cli.py keywords.txt -o results.ndjson --resume   # 중단된 곳부터 이어서
+
+체크포인트(기본: 출력파일.checkpoint)에는 기록을 마친 입력 줄 수와 출력 파일 크기가 남는다.
+--resume 이면 그만큼 입력을 건너뛰고, 출력 파일을 그 크기로 잘라낸 뒤 이어서 쓴다.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import app
+
+CHECKPOINT_VERSION = 1
+
+def iter_keywords(stream, skip=0):
+    """(줄 번호, 키워드) 를 하나씩 넘겨줌. 빈 줄은 건너뛰지만 줄 번호에는 포함"""
+    for line_no, line in enumerate(stream, start=1):
+        if line_no <= skip:
+            continue
+        keyword = line.strip()
+        if keyword:
+            yield line_no, keyword
+
+def count_lines(path):
+    with open(path, "rb") as f:
+        return sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(1 << 20), b""))
+
+class Checkpoint:
+    def __init__(self, path, params):
+        self.path = path
+        self.params = params
+        self.lines = 0 # 결과를 모두 기록한 입력 줄 수
+        self.offset = 0 # 그 시점의 출력 파일 크기
+        self.written = 0
+        self.skipped = 0
+        self.duplicates = 0
+        self.errors = 0
+
+    def load(self):
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("params") != self.params:
+            raise SystemExit(f"체크포인트 옵션이 다릅니다: {data.get('params')} (현재 {self.params})")
+        self.lines = data["lines"]
+        self.offset = data["offset"]
+        self.written = data["written"]
+        self.skipped = data.get("skipped", 0)
+        self.duplicates = data.get("duplicates", 0)
+        self.errors = data.get("errors", 0)
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": CHECKPOINT_VERSION, "params": self.params, "lines": self.lines,
+                       "offset": self.offset, "written": self.written, "skipped": self.skipped,
+                       "duplicates": self.duplicates, "errors": self.errors, "saved_at": time.time()}, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+class ResultWriter:
+    def __init__(self, path, output_format, columns, offset=0):
+        # 체크포인트 이후에 쓰다 만 부분은 잘라내고 이어서 씀
+        if offset:
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+        self.file = open(path, "a" if offset else "w", encoding="utf-8", newline="")
+        self.format = output_format
+        self.columns = columns
+        self.csv = csv.writer(self.file, quoting=csv.QUOTE_ALL, lineterminator="\n") if output_format == "csv" else None
+        if self.csv and not offset:
+            self.file.write("\ufeff") # 엑셀에서 한글이 깨지지 않도록 BOM
+            self.csv.writerow([app.EXPORT_COLUMNS[c] for c in columns])
+
+    def write(self, line_no, result):
+        if self.csv:
+            self.csv.writerow(app.export_csv_values(result, self.columns))
+        else:
+            self.file.write(json.dumps(dict(result, line=line_no), ensure_ascii=False) + "\n")
+
+    def flush(self):
+        self.file.flush()
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+def wait_for_breaker():
+    # 브레이커가 닫혔다는 알림을 못 받아도 최대 cooldown 상한만큼만 기다리고 다시 시도
+    closed = threading.Event()
+    app.SERP_BREAKER.call_when_closed(closed.set)
+    closed.wait(timeout=app.SERP_BREAKER_COOLDOWN_MAX)
+
+def prepare_keywords(entries, args):
+    """묶음 안 키워드의 저장 결과를 확인하고, 검색량이 필요한 키워드만 모아서 한꺼번에 조회 (BatchJob.prepare 와 같은 방식)
+
+    entries 는 (키워드, Future) 목록. Future 에는 (저장 결과, 재사용할 단계, 검색량) 을 넣고,
+    계획을 못 세운 키워드는 None 을 넣어서 analyze_keyword 가 직접 처리하게 한다.
+    """
+    waiting = {} # volume_key -> [(Future, 저장 결과, 단계)]
+    try:
+        for keyword, prepared in entries:
+            stored, stages = app.plan_stored_result(keyword, args.fetch_isbn, args.min_search_volume, args.refresh, args.max_age)
+            if stored is not None or "volume" in stages:
+                prepared.set_result((stored, stages, None))
+            else:
+                waiting.setdefault(app.volume_key(keyword), []).append((prepared, stored, stages))
+
+        def on_resolved(resolved):
+            for key, volume in resolved.items():
+                for prepared, stored, stages in waiting.pop(key, ()):
+                    prepared.set_result((stored, stages, volume))
+        keywords = [keyword for keyword, prepared in entries if not prepared.done()]
+        app.resolve_search_volumes(keywords, on_resolved=on_resolved, use_cache=not args.no_cache)
+    finally:
+        for keyword, prepared in entries:
+            if not prepared.done():
+                prepared.set_result(None)
+
+def analyze_keyword(keyword, args, prepared=None):
+    """저장소에 신선한 결과가 있으면 그대로 쓰고, 없으면 분석 후 저장. (결과, 저장 결과 재사용 여부)
+
+    prepared 는 prepare_keywords 가 채우는 Future. 검색량을 못 받았으면(None) analyze_book 이 직접 조회한다.
+    """
+    plan = prepared.result() if prepared is not None else None
+    if plan is None:
+        stored, stages = app.plan_stored_result(keyword, args.fetch_isbn, args.min_search_volume, args.refresh, args.max_age)
+        search_volume = None
+    else:
+        stored, stages, search_volume = plan
+    if stored is not None:
+        return dict(stored, keyword=keyword), True
+
+    timings = {} if args.timings else None
+    for attempt in range(app.SERP_MAX_REQUEUE + 1):
+        try:
+            result = app.analyze_book(keyword, fetch_isbn=args.fetch_isbn, min_search_volume=args.min_search_volume,
+                                      search_volume=search_volume, no_cache=args.no_cache, stages=stages, timings=timings)
+        except Exception as e:
+            result = {"keyword": keyword, "search_volume": 0, "seller_count": "-", "grade": "오류",
+                      "reason": f"분석 실패 ({str(e)[:20]})", "isbn": "-", "link": "#", "shipping_fee": "-",
+                      "store_rank": "-", "store_ranks": {}}
+        # 봇 차단이면 브레이커가 닫힐 때까지 기다렸다가 다시 (받아둔 검색량/순위 단계는 stages 로 재사용)
+        if not app.is_bot_blocked(result) or attempt == app.SERP_MAX_REQUEUE:
+            break
+        wait_for_breaker()
+
+    if args.webhook:
+        app.send_webhook(result)
+    if app.should_store_result(result, stages):
+        app.RESULT_STORE.save_result(keyword, args.fetch_isbn, args.min_search_volume, result, stages)
+    if timings is not None:
+        result = dict(result, timings=timings)
+    return result, False
+
+class Progress:
+    def __init__(self, total, interval, checkpoint):
+        self.total = total
+        self.interval = interval
+        self.checkpoint = checkpoint
+        self.started = time.monotonic()
+        self.start_written = checkpoint.written
+        self.last_report = self.started
+
+    def report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        cp = self.checkpoint
+        rate = (cp.written - self.start_written) / max(now - self.started, 1e-9)
+        total = f"/{self.total}줄" if self.total else "줄"
+        print(f"[{time.strftime('%H:%M:%S')}] {cp.lines}{total} 처리, 결과 {cp.written}건 "
+              f"(재사용 {cp.skipped}, 중복 {cp.duplicates}, 오류 {cp.errors}) {rate:.1f}건/초", file=sys.stderr, flush=True)
+
+def run(args):
+    params = {"fetch_isbn": args.fetch_isbn, "min_search_volume": args.min_search_volume,
+              "format": args.format, "columns": args.columns}
+    checkpoint = Checkpoint(args.checkpoint or args.output + ".checkpoint", params)
+    if args.resume and os.path.exists(checkpoint.path):
+        checkpoint.load()
+        print(f"체크포인트에서 이어서 시작: {checkpoint.lines}줄까지 완료", file=sys.stderr)
+    elif args.resume:
+        print("체크포인트가 없어 처음부터 시작", file=sys.stderr)
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8-sig")
+    total = count_lines(args.input) if args.input != "-" else None
+    writer = ResultWriter(args.output, args.format, args.columns, offset=checkpoint.offset)
+    progress = Progress(total, args.progress_interval, checkpoint)
+    executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="cli")
+    volume_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cli-volume")
+    window_size = args.workers * 4
+    window = deque() # 입력 순서대로 (줄 번호, 원래 키워드, Future, 중복 여부). 최대 window_size 개
+    recent = OrderedDict() # keyword_key -> Future (최근 --dedup-window 개)
+    unprepared = [] # 검색량을 아직 묶어서 조회하지 않은 (키워드, Future)
+    preparing = deque() # (prepare_keywords 작업, 그 묶음)
+    since_save = 0
+
+    def flush_unprepared():
+        nonlocal unprepared
+        if unprepared:
+            preparing.append((volume_executor.submit(prepare_keywords, unprepared, args), unprepared))
+            unprepared = []
+        while preparing and preparing[0][0].done():
+            preparing.popleft()
+
+    def write_head():
+        nonlocal since_save
+        flush_unprepared() # 맨 앞 결과를 기다리기 전에 모아둔 키워드의 검색량 조회를 시작
+        line_no, keyword, future, duplicate = window[0]
+        result, reused = future.result()
+        window.popleft() # 결과를 받은 뒤에 빼야 기다리는 중에 중단돼도 줄을 잃지 않음
+        writer.write(line_no, dict(result, keyword=keyword))
+        checkpoint.lines = line_no
+        checkpoint.written += 1
+        checkpoint.duplicates += duplicate
+        checkpoint.skipped += reused and not duplicate
+        checkpoint.errors += result["grade"] == "오류"
+        since_save += 1
+        if since_save >= args.checkpoint_every:
+            checkpoint.offset = writer.flush()
+            checkpoint.save()
+            since_save = 0
+        progress.report()
+
+    interrupted = False
+    try:
+        for line_no, keyword in iter_keywords(source, skip=checkpoint.lines):
+            key = app.keyword_key(keyword)
+            future = recent.get(key)
+            duplicate = future is not None
+            if duplicate:
+                recent.move_to_end(key)
+            else:
+                normalized, prepared = app.normalize_keyword(keyword), Future()
+                unprepared.append((normalized, prepared))
+                future = recent[key] = executor.submit(analyze_keyword, normalized, args, prepared)
+                if len(recent) > args.dedup_window:
+                    recent.popitem(last=False)
+            window.append((line_no, keyword, future, duplicate))
+            if len(unprepared) >= window_size:
+                flush_unprepared()
+            while window and (len(window) >= window_size or window[0][2].done()):
+                write_head()
+        while window:
+            write_head()
+        if total is not None:
+            checkpoint.lines = max(checkpoint.lines, total) # 끝의 빈 줄까지 처리한 것으로 표시
+    except KeyboardInterrupt:
+        interrupted = True
+        print("중단 요청: 끝난 결과까지만 기록합니다", file=sys.stderr)
+        for entry in window:
+            entry[2].cancel()
+        # 시작 못 한 검색량 조회는 취소하고, 그 키워드를 기다리던 분석은 직접 조회하게 풀어줌
+        for task, entries in list(preparing) + [(None, unprepared)]:
+            if task is None or task.cancel():
+                for _, prepared in entries:
+                    prepared.set_result(None)
+        while window and window[0][2].done() and not window[0][2].cancelled():
+            write_head()
+    finally:
+        executor.shutdown(wait=not interrupted, cancel_futures=True)
+        volume_executor.shutdown(wait=not interrupted)
+        checkpoint.offset = writer.flush()
+        checkpoint.save()
+        writer.close()
+        if source is not sys.stdin:
+            source.close()
+        progress.report(force=True)
+    return 130 if interrupted else 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="키워드 파일 (한 줄에 하나, - 이면 표준입력)")
+    parser.add_argument("-o", "--output", required=True, help="결과 파일")
+    parser.add_argument("--format", choices=("ndjson", "csv"), default=None, help="기본: 출력 파일 확장자로 판단")
+    parser.add_argument("--columns", default=",".join(app.EXPORT_DEFAULT_COLUMNS), help="CSV 열 (쉼표 구분)")
+    parser.add_argument("--workers", type=int, default=app.BATCH_WORKERS)
+    parser.add_argument("--fetch-isbn", action="store_true")
+    parser.add_argument("--min-search-volume", type=int, default=0)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--refresh", choices=app.REFRESH_MODES, default="missing")
+    parser.add_argument("--max-age", type=int, default=app.RESULT_MAX_AGE, help="이 시간(초) 안에 분석한 결과는 재사용")
+    parser.add_argument("--dedup-window", type=int, default=10000, help="중복 키워드를 찾을 최근 키워드 수")
+    parser.add_argument("--webhook", action="store_true", help="결과를 스터디박스 웹훅 outbox 에도 넣음")
+    parser.add_argument("--timings", action="store_true", help="NDJSON 결과에 단계별 소요 시간 포함")
+    parser.add_argument("--checkpoint", default=None, help="기본: 출력파일.checkpoint")
+    parser.add_argument("--checkpoint-every", type=int, default=50, help="결과 몇 건마다 체크포인트를 저장할지")
+    parser.add_argument("--resume", action="store_true", help="체크포인트가 있으면 이어서 실행")
+    parser.add_argument("--progress-interval", type=float, default=10, help="진행 상황 출력 간격(초)")
+    args = parser.parse_args()
+
+    args.format = args.format or ("csv" if args.output.lower().endswith(".csv") else "ndjson")
+    args.columns = [c for c in args.columns.split(",") if c in app.EXPORT_COLUMNS] or app.EXPORT_DEFAULT_COLUMNS
+    args.workers = max(1, args.workers)
+    args.checkpoint_every = max(1, args.checkpoint_every)
+    return run(args)
+
+if __name__ == "__main__":
+    sys.exit(main())